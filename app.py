@@ -1,23 +1,34 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, Response
+from flask import Blueprint, Flask, render_template, redirect, url_for, request, flash, jsonify, Response, \
+    stream_with_context, current_app, g, abort, send_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from datetime import datetime
-import enum, os
-from io import StringIO
-import csv
-
-# ------------------- APP CONFIG -------------------
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('ROADGUARD_SECRET', 'dev-secret')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///roadguard.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+from sqlalchemy import text, func, insert, update, bindparam, orm
+from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, timedelta
+import enum, os, threading, time
+from geo import MechanicIndex, geohash, geohash_center
+import click
+import numpy as np
+import dispatch
+from cache import SimpleCache
+import report
+from events import create_broker, sse_stream
+from metrics import Metrics
+from database import apply_sqlite_pragmas, database_config
+from uploads import MIMETYPES, VARIANTS, Thumbnailer, UploadError, UploadStore
+import otp
+from otp import otp_bp
 
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+# ------------------- EXTENSIONS -------------------
+# Bound to an app in create_app()
+db = SQLAlchemy()
+metrics = Metrics()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
 
-from otp import otp_bp
-app.register_blueprint(otp_bp)
+# Pages, APIs and CLI commands all hang off this blueprint
+main = Blueprint('main', __name__, cli_group=None)
 
 # ------------------- MODELS -------------------
 class Role(enum.Enum):
@@ -26,22 +37,59 @@ class Role(enum.Enum):
     ADMIN = "admin"
 
 class User(UserMixin, db.Model):
+    __table_args__ = (
+        # Delta sync of the mechanic index, see sync_mechanic_index()
+        db.Index('ix_user_location_updated', 'location_updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120))
     email = db.Column(db.String(120), unique=True)
     password = db.Column(db.String(120))
     role = db.Column(db.String(20), default=Role.USER.value)
     phone = db.Column(db.String(20))
+    # Last known position, only kept for mechanics
+    lat = db.Column(db.Float, nullable=True)
+    lng = db.Column(db.Float, nullable=True)
+    location_updated_at = db.Column(db.DateTime, nullable=True)
+    # Denormalized so the navbar badge never has to count rows
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Highest role-broadcast notification id this user has read
+    broadcast_read_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @property
+    def has_unread_notifications(self):
+        return self.unread_notifications > 0 or latest_broadcast_id(self.role) > self.broadcast_read_id
 
 class Notification(db.Model):
+    __table_args__ = (
+        db.Index('ix_notification_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notification_role_broadcast', 'role', 'user_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     role = db.Column(db.String(20))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     message = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.relationship("User", backref="notifications")
+    is_read = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    user = db.relationship("User", backref=db.backref("notifications", lazy="dynamic"))
+
+    @property
+    def is_broadcast(self):
+        return self.user_id is None
+
+    def read_by(self, user):
+        if self.is_broadcast:
+            return self.id <= user.broadcast_read_id
+        return self.is_read
 
 class ServiceRequest(db.Model):
+    __table_args__ = (
+        db.Index('ix_request_user_created', 'user_id', 'created_at'),
+        db.Index('ix_request_mechanic_status_created', 'assigned_mechanic_id', 'status', 'created_at'),
+        db.Index('ix_request_status_created', 'status', 'created_at'),
+        # Unfiltered newest-first feed (the admin's default view)
+        db.Index('ix_request_created', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     title = db.Column(db.String(200))
@@ -52,30 +100,766 @@ class ServiceRequest(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     assigned_mechanic_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     mechanic_response = db.Column(db.Text, nullable=True)
+    # Stored upload name (<sha256>.<ext>), see uploads.UploadStore
+    image = db.Column(db.String(80), nullable=True)
+    # When the current mechanic was assigned; start of the time-to-accept clock
+    assigned_at = db.Column(db.DateTime, nullable=True)
 
     user = db.relationship("User", foreign_keys=[user_id], backref="requests_made")
     mechanic = db.relationship("User", foreign_keys=[assigned_mechanic_id], backref="requests_taken")
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "description": self.description,
+            "status": self.status,
+            "lat": self.lat,
+            "lng": self.lng,
+            "created_at": self.created_at.strftime('%Y-%m-%d %H:%M') if self.created_at else None,
+            "user": self.user.name if self.user else None,
+            "mechanic": self.mechanic.name if self.mechanic else None,
+            "mechanic_response": self.mechanic_response,
+            "image": self.image,
+        }
+
+class RequestEvent(db.Model):
+    """Append-only log of request status changes; the analytics rollups are derived from it."""
+    __table_args__ = (
+        db.Index('ix_request_event_request_created', 'request_id', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    request_id = db.Column(db.Integer, db.ForeignKey('service_request.id'), nullable=False)
+    from_status = db.Column(db.String(50), nullable=True)
+    to_status = db.Column(db.String(50), nullable=False)
+    mechanic_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    # Geohash of the request location at GEOHASH_PRECISION
+    cell = db.Column(db.String(12), nullable=True)
+    # Seconds to reach this status, see transition()
+    duration = db.Column(db.Float, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class RequestRollup(db.Model):
+    """Event counts and duration sums per time bucket, status and dimension.
+
+    dim is 'all' (dim_key ''), 'mechanic' (dim_key is the user id) or 'cell'
+    (dim_key is a geohash, lat/lng its centre). Rows only ever grow by upsert.
+    """
+    __table_args__ = (
+        db.Index('ux_rollup_bucket', 'grain', 'dim', 'dim_key', 'status', 'bucket', unique=True),
+        db.Index('ix_rollup_scan', 'grain', 'dim', 'status', 'bucket'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(4), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    dim = db.Column(db.String(8), nullable=False)
+    dim_key = db.Column(db.String(16), nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    events = db.Column(db.Integer, nullable=False, default=0)
+    duration_sum = db.Column(db.Float, nullable=False, default=0.0)
+    duration_n = db.Column(db.Integer, nullable=False, default=0)
+    lat = db.Column(db.Float, nullable=True)
+    lng = db.Column(db.Float, nullable=True)
+
+# ------------------- FORM HELPERS -------------------
+def picked_mechanic_id(value):
+    """Mechanic id from a form value: a bare id or a 'Name #id' entry from the mechanics datalist."""
+    tail = (value or '').rpartition('#')[2].strip()
+    return int(tail) if tail.isdigit() else None
+
+# ------------------- PAGINATION -------------------
+def encode_cursor(row):
+    """Opaque keyset cursor for newest-first (created_at, id) ordering."""
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on garbage."""
+    ts, _, row_id = cursor.rpartition('_')
+    return datetime.fromisoformat(ts), int(row_id)
+
+def older_than(model, before):
+    """Filter for rows after `before` in newest-first (created_at, id) order."""
+    ts, row_id = before
+    return db.or_(model.created_at < ts, db.and_(model.created_at == ts, model.id < row_id))
+
 # ------------------- LOGIN MANAGER -------------------
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
 # ------------------- INIT DATABASE -------------------
-with app.app_context():
+ADMIN_EMAIL = 'admin@roadguard.local'
+ADMIN_PASSWORD = 'admin'
+
+# Run once right after a column is added to an existing table
+COLUMN_BACKFILLS = {
+    ('user', 'unread_notifications'):
+        'UPDATE "user" SET unread_notifications = '
+        '(SELECT COUNT(*) FROM notification WHERE notification.user_id = "user".id)',
+}
+
+def upgrade_schema():
+    """create_all() never alters existing tables, so add new columns and indexes by hand."""
+    insp = db.inspect(db.engine)
+    quote = db.engine.dialect.identifier_preparer.quote
+    for table in db.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c['name'] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(col.name)} {col.type.compile(db.engine.dialect)}"
+            if col.server_default is not None:
+                ddl += f" DEFAULT {col.server_default.arg}"
+            db.session.execute(text(ddl))
+            if (table.name, col.name) in COLUMN_BACKFILLS:
+                db.session.execute(text(COLUMN_BACKFILLS[(table.name, col.name)]))
+        db.session.commit()
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    db.session.commit()
+
+def seed_admin():
+    if not User.query.filter_by(email=ADMIN_EMAIL).first():
+        db.session.add(User(name='Admin', email=ADMIN_EMAIL, password=ADMIN_PASSWORD, role=Role.ADMIN.value))
+        db.session.commit()
+
+def init_db(seed=True):
     db.create_all()
-    if not User.query.filter_by(email='admin@roadguard.local').first():
-        admin = User(name='Admin', email='admin@roadguard.local', password='admin', role=Role.ADMIN.value)
-        db.session.add(admin)
+    upgrade_schema()
+    if seed:
+        seed_admin()
+
+@main.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables, columns and indexes on an existing database."""
+    init_db(seed=False)
+    click.echo("Database schema is up to date")
+
+@main.cli.command('init-db')
+@click.option('--no-seed', is_flag=True, help='Skip creating the default admin account.')
+def init_db_command(no_seed):
+    """Create the schema and seed the admin account; run once per deploy, not per worker."""
+    init_db(seed=not no_seed)
+    click.echo("Database initialized")
+
+# ------------------- READ REPLICA -------------------
+def read_session():
+    """Session for dashboard and report reads: the replica bind if configured, else db.session."""
+    engine = db.engines.get('replica')
+    if engine is None:
+        return db.session
+    if 'read_session' not in g:
+        g.read_session = orm.Session(engine)
+    return g.read_session
+
+def close_read_session(exc=None):
+    session = g.pop('read_session', None)
+    if session is not None:
+        session.close()
+
+# ------------------- NOTIFICATIONS -------------------
+NOTIFICATIONS_PER_PAGE = 20
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('ROADGUARD_NOTIFICATION_RETENTION_DAYS', 90))
+
+notification_cache = SimpleCache(ttl=5)
+
+def notify(rows):
+    """Insert direct notification rows and bump each recipient's unread counter.
+
+    rows is an iterable of dicts with role, user_id and message. Runs in the
+    caller's transaction; the caller commits.
+    """
+    rows = [r for r in rows if r.get('user_id') is not None]
+    if not rows:
+        return
+    db.session.execute(insert(Notification), rows)
+    counts = {}
+    for r in rows:
+        counts[r['user_id']] = counts.get(r['user_id'], 0) + 1
+    users = User.__table__
+    db.session.execute(
+        update(users).where(users.c.id == bindparam('uid'))
+        .values(unread_notifications=users.c.unread_notifications + bindparam('n')),
+        [{'uid': uid, 'n': n} for uid, n in counts.items()])
+
+def broadcast(role, message):
+    """Store a single notification addressed to every user with `role`."""
+    db.session.add(Notification(role=role, user_id=None, message=message))
+    notification_cache.invalidate(('latest_broadcast', role))
+
+def latest_broadcast_id(role):
+    """Id of the newest broadcast for `role` (0 if none), cached briefly."""
+    def load():
+        return db.session.query(Notification.id).filter(
+            Notification.role == role, Notification.user_id.is_(None)
+        ).order_by(Notification.created_at.desc(), Notification.id.desc()).limit(1).scalar() or 0
+    return notification_cache.get_or_set(('latest_broadcast', role), load)
+
+def unread_broadcast_count(user):
+    return db.session.query(func.count(Notification.id)).filter(
+        Notification.role == user.role, Notification.user_id.is_(None),
+        Notification.id > user.broadcast_read_id).scalar()
+
+def notification_feed(user, before=None, limit=NOTIFICATIONS_PER_PAGE):
+    """Newest-first page of direct and role-broadcast notifications.
+
+    Each side is an index-backed keyset query limited on its own, so the merge
+    only ever sorts 2 * limit rows.
+    """
+    def page(*conds):
+        q = db.select(Notification.id).where(*conds)
+        if before:
+            q = q.where(older_than(Notification, before))
+        return db.select(q.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit).subquery())
+    ids = db.union_all(
+        page(Notification.user_id == user.id),
+        page(Notification.user_id.is_(None), Notification.role == user.role),
+    )
+    return Notification.query.filter(Notification.id.in_(ids)) \
+        .order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit).all()
+
+def mark_notifications_read(user, ids=None):
+    """Mark the user's unread notifications (or just `ids`) read; returns how many direct rows changed.
+
+    Broadcasts use a per-user cursor, so reading one marks every older broadcast read too.
+    """
+    shared = db.session.query(func.max(Notification.id)).filter(
+        Notification.role == user.role, Notification.user_id.is_(None))
+    if ids is not None:
+        shared = shared.filter(Notification.id.in_(ids))
+    newest = shared.scalar()
+    if newest and newest > user.broadcast_read_id:
+        user.broadcast_read_id = newest
+
+    q = Notification.query.filter(Notification.user_id == user.id, Notification.is_read.is_(False))
+    if ids is not None:
+        q = q.filter(Notification.id.in_(ids))
+    changed = q.update({Notification.is_read: True}, synchronize_session=False)
+    if changed:
+        if ids is None:
+            user.unread_notifications = 0
+        else:
+            remaining = User.unread_notifications - changed
+            user.unread_notifications = db.case((remaining < 0, 0), else_=remaining)
+    db.session.commit()
+    return changed
+
+@main.cli.command('prune-notifications')
+@click.option('--days', default=NOTIFICATION_RETENTION_DAYS, show_default=True, help='Delete notifications older than this.')
+@click.option('--include-unread', is_flag=True, help='Also delete old notifications that were never read.')
+@click.option('--batch-size', default=5000, show_default=True)
+def prune_notifications_command(days, include_unread, batch_size):
+    """Delete old notifications in small batches."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = 0
+    touched = set()
+    while True:
+        q = db.session.query(Notification.id, Notification.user_id, Notification.is_read).filter(Notification.created_at < cutoff)
+        if not include_unread:
+            # Broadcast read state lives in per-user cursors, so old broadcasts always go
+            q = q.filter(db.or_(Notification.is_read.is_(True), Notification.user_id.is_(None)))
+        batch = q.limit(batch_size).all()
+        if not batch:
+            break
+        touched.update(uid for _, uid, is_read in batch if not is_read and uid is not None)
+        Notification.query.filter(Notification.id.in_([nid for nid, _, _ in batch])).delete(synchronize_session=False)
         db.session.commit()
+        deleted += len(batch)
+    if touched:
+        unread = db.session.query(func.count(Notification.id)).filter(
+            Notification.user_id == User.id, Notification.is_read.is_(False)).scalar_subquery()
+        User.query.filter(User.id.in_(touched)).update({User.unread_notifications: unread}, synchronize_session=False)
+        db.session.commit()
+    click.echo(f"Deleted {deleted} notification(s) older than {days} days")
+
+# ------------------- LIVE EVENTS -------------------
+broker = create_broker(os.environ.get('ROADGUARD_BROKER_URL'))
+
+def request_event(kind, sr, message):
+    """Payload the dashboards use to patch a request card in place."""
+    return dict(sr.to_dict(), type=kind, request_id=sr.id, message=message)
+
+def publish_request_event(kind, sr, message, user_ids=(), roles=()):
+    """Push a request change to user and role channels; call after commit."""
+    event = request_event(kind, sr, message)
+    channels = [f"user:{uid}" for uid in user_ids if uid is not None] + [f"role:{role}" for role in roles]
+    for channel in channels:
+        try:
+            broker.publish(channel, event)
+        except Exception:
+            # Live updates are best effort; the write already committed
+            current_app.logger.warning("failed to publish %s to %s", kind, channel, exc_info=True)
+
+# ------------------- MECHANIC INDEX -------------------
+ACTIVE_STATUSES = ('pending', 'accepted', 'enroute')
+NEAREST_SUGGESTIONS = 10
+mechanic_index = MechanicIndex()
+# Each worker has its own index; other workers' writes reach it through a
+# periodic delta sync: moved mechanics by location_updated_at, busy flags for
+# mechanics named in new request events.
+MECHANIC_INDEX_SYNC_SECONDS = float(os.environ.get('ROADGUARD_MECHANIC_INDEX_SYNC', 15))
+# Re-read this far behind the watermark so rows committed late are not missed
+MECHANIC_INDEX_SYNC_OVERLAP = timedelta(seconds=30)
+mechanic_sync = {"located_at": None, "event_id": 0, "due": 0.0}
+mechanic_sync_lock = threading.Lock()
+
+def get_mechanic_index():
+    """Return the spatial index, loading it on first use and syncing it every MECHANIC_INDEX_SYNC_SECONDS."""
+    if not mechanic_index.loaded or time.monotonic() >= mechanic_sync["due"]:
+        # One thread syncs; the others carry on with the current index
+        if mechanic_sync_lock.acquire(blocking=not mechanic_index.loaded):
+            try:
+                sync_mechanic_index()
+            finally:
+                mechanic_sync_lock.release()
+    return mechanic_index
+
+def sync_mechanic_index():
+    """Full load the first time, then only mechanics that moved and those named in new request events."""
+    full = not mechanic_index.loaded
+    located_at = mechanic_sync["located_at"]
+    event_id = mechanic_sync["event_id"]
+    # Read the event watermark first: anything logged while we load is picked up next time
+    latest_event = db.session.query(func.max(RequestEvent.id)).scalar() or 0
+
+    rows = db.session.query(User.id, User.lat, User.lng, User.location_updated_at).filter(
+        User.role == Role.MECHANIC.value)
+    if full:
+        rows = rows.filter(User.lat.isnot(None), User.lng.isnot(None))
+    elif located_at is None:
+        rows = rows.filter(User.location_updated_at.isnot(None))
+    else:
+        rows = rows.filter(User.location_updated_at > located_at - MECHANIC_INDEX_SYNC_OVERLAP)
+    for mech_id, lat, lng, updated_at in rows:
+        mechanic_index.update(mech_id, lat, lng)
+        if updated_at and (located_at is None or updated_at > located_at):
+            located_at = updated_at
+
+    busy = db.session.query(ServiceRequest.assigned_mechanic_id).filter(
+        ServiceRequest.assigned_mechanic_id.isnot(None),
+        ServiceRequest.status.in_(ACTIVE_STATUSES))
+    if full:
+        for (mech_id,) in busy.distinct():
+            mechanic_index.set_busy(mech_id)
+    elif latest_event > event_id:
+        touched = {mech_id for (mech_id,) in db.session.query(RequestEvent.mechanic_id).filter(
+            RequestEvent.id > event_id, RequestEvent.id <= latest_event,
+            RequestEvent.mechanic_id.isnot(None)).distinct()}
+        if touched:
+            active = {mech_id for (mech_id,) in busy.filter(
+                ServiceRequest.assigned_mechanic_id.in_(touched)).distinct()}
+            for mech_id in touched:
+                mechanic_index.set_busy(mech_id, mech_id in active)
+
+    mechanic_sync.update(located_at=located_at, event_id=latest_event,
+                         due=time.monotonic() + MECHANIC_INDEX_SYNC_SECONDS)
+    mechanic_index.loaded = True
+
+def refresh_mechanic_busy(mech_id):
+    """Recompute whether a mechanic still has an active request."""
+    if mech_id is None or not mechanic_index.loaded:
+        return
+    active = db.session.query(ServiceRequest.id).filter(
+        ServiceRequest.assigned_mechanic_id == mech_id,
+        ServiceRequest.status.in_(ACTIVE_STATUSES)).first()
+    mechanic_index.set_busy(mech_id, active is not None)
+
+# ------------------- AUTO DISPATCH -------------------
+# Unassigned requests in these states are up for dispatch
+DISPATCHABLE_STATUSES = ('submitted', 'rejected')
+DISPATCH_LOAD_CAP = int(os.environ.get('ROADGUARD_DISPATCH_LOAD_CAP', 1))
+
+def run_dispatch(load_cap=DISPATCH_LOAD_CAP, method='greedy', max_km=None, dry_run=False):
+    """Assign every unassigned request to a nearby mechanic in one transaction.
+
+    Returns a list of (request_id, mechanic_id, distance_km) tuples.
+    """
+    pending = db.session.query(ServiceRequest.id, ServiceRequest.lat, ServiceRequest.lng,
+                               ServiceRequest.status, ServiceRequest.created_at).filter(
+        ServiceRequest.assigned_mechanic_id.is_(None),
+        ServiceRequest.status.in_(DISPATCHABLE_STATUSES),
+        (ServiceRequest.lat != 0) | (ServiceRequest.lng != 0)).all()
+    mechs = db.session.query(User.id, User.lat, User.lng).filter(
+        User.role == Role.MECHANIC.value, User.lat.isnot(None), User.lng.isnot(None)).all()
+    if not pending or not mechs:
+        return []
+
+    load = dict(db.session.query(ServiceRequest.assigned_mechanic_id, func.count(ServiceRequest.id)).filter(
+        ServiceRequest.assigned_mechanic_id.isnot(None),
+        ServiceRequest.status.in_(ACTIVE_STATUSES)).group_by(ServiceRequest.assigned_mechanic_id).all())
+    capacity = np.array([load_cap - load.get(m.id, 0) for m in mechs])
+
+    match, km = dispatch.solve(
+        np.array([p.lat for p in pending]), np.array([p.lng for p in pending]),
+        np.array([m.lat for m in mechs]), np.array([m.lng for m in mechs]),
+        capacity, method=method, max_km=max_km)
+    assignments = [(pending[i].id, mechs[j].id, float(km[i])) for i, j in enumerate(match) if j >= 0]
+    if dry_run or not assignments:
+        return assignments
+
+    now = datetime.utcnow()
+    # The solve can take a second; a manual assign or another dispatch may have
+    # claimed some of these requests meanwhile, so only write rows that are
+    # still unassigned and keep just the ones this update actually changed.
+    table = ServiceRequest.__table__
+    db.session.execute(update(table).where(
+        table.c.id == bindparam('req_id'),
+        table.c.assigned_mechanic_id.is_(None),
+        # Spelled out: an IN list cannot be expanded inside an executemany
+        db.or_(*(table.c.status == st for st in DISPATCHABLE_STATUSES)),
+    ).values(assigned_mechanic_id=bindparam('mech_id'), status='pending', assigned_at=now), [
+        {"req_id": req_id, "mech_id": mech_id} for req_id, mech_id, _ in assignments])
+    written = dict(db.session.query(ServiceRequest.id, ServiceRequest.assigned_mechanic_id).filter(
+        ServiceRequest.id.in_([req_id for req_id, _, _ in assignments]), ServiceRequest.assigned_at == now))
+    assignments = [a for a in assignments if written.get(a[0]) == a[1]]
+    if not assignments:
+        db.session.rollback()
+        return []
+    pending_by_id = {p.id: p for p in pending}
+    log_transitions(transition(pending_by_id[req_id], "pending", pending_by_id[req_id].status,
+                               mechanic_id=mech_id, now=now)
+                    for req_id, mech_id, _ in assignments)
+    notify(
+        {"role": Role.MECHANIC.value, "user_id": mech_id, "message": f"Request #{req_id} assigned to you"}
+        for req_id, mech_id, _ in assignments)
+    db.session.commit()
+    invalidate_stats()
+    if mechanic_index.loaded:
+        for _, mech_id, _ in assignments:
+            mechanic_index.set_busy(mech_id)
+    assigned = ServiceRequest.query.options(joinedload(ServiceRequest.mechanic)) \
+        .filter(ServiceRequest.id.in_([req_id for req_id, _, _ in assignments]))
+    for sr in assigned:
+        publish_request_event("assigned", sr, f"Request #{sr.id} assigned to {sr.mechanic.name}",
+                              user_ids=(sr.user_id, sr.assigned_mechanic_id))
+    return assignments
+
+@main.cli.command('dispatch')
+@click.option('--load-cap', default=DISPATCH_LOAD_CAP, show_default=True, help='Max active requests per mechanic.')
+@click.option('--method', type=click.Choice(sorted(dispatch.MATCHERS)), default='greedy', show_default=True)
+@click.option('--max-km', type=float, default=None, help='Never assign a mechanic further than this.')
+@click.option('--dry-run', is_flag=True, help='Print the plan without writing it.')
+def dispatch_command(load_cap, method, max_km, dry_run):
+    """Auto-assign all pending requests to nearby mechanics."""
+    assignments = run_dispatch(load_cap=load_cap, method=method, max_km=max_km, dry_run=dry_run)
+    for req_id, mech_id, km in assignments:
+        click.echo(f"request #{req_id} -> mechanic #{mech_id} ({km:.1f} km)")
+    click.echo(f"{len(assignments)} request(s) {'would be ' if dry_run else ''}assigned")
+
+# ------------------- ADMIN STATS -------------------
+STATUSES = ('submitted', 'pending', 'accepted', 'rejected', 'enroute', 'completed')
+MECHANIC_CHART_TOP = 10
+stats_cache = SimpleCache(ttl=30)
+
+def compute_admin_stats():
+    """Aggregate dashboard numbers with GROUP BY/COUNT instead of loading rows."""
+    session = read_session()
+    by_status = dict(session.query(ServiceRequest.status, func.count(ServiceRequest.id))
+                     .group_by(ServiceRequest.status).all())
+
+    per_mechanic = session.query(User.name, func.count(ServiceRequest.id)) \
+        .outerjoin(ServiceRequest, ServiceRequest.assigned_mechanic_id == User.id) \
+        .filter(User.role == Role.MECHANIC.value) \
+        .group_by(User.id, User.name).order_by(func.count(ServiceRequest.id).desc()).all()
+    top, rest = per_mechanic[:MECHANIC_CHART_TOP], per_mechanic[MECHANIC_CHART_TOP:]
+    mechanic_labels = [name for name, _ in top]
+    mechanic_counts = [n for _, n in top]
+    if rest:
+        mechanic_labels.append('Others')
+        mechanic_counts.append(sum(n for _, n in rest))
+
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    hour = func.extract('hour', ServiceRequest.created_at)
+    hourly = [0] * 24
+    for h, n in session.query(hour, func.count(ServiceRequest.id)) \
+            .filter(ServiceRequest.created_at >= today).group_by(hour).all():
+        hourly[int(h)] = n
+
+    roles = dict(session.query(User.role, func.count(User.id)).group_by(User.role).all())
+    return {
+        "total_requests": sum(by_status.values()),
+        "total_mechanics": roles.get(Role.MECHANIC.value, 0),
+        "total_users": roles.get(Role.USER.value, 0),
+        "status_labels": list(STATUSES),
+        "status_counts": [by_status.get(st, 0) for st in STATUSES],
+        "mechanic_labels": mechanic_labels,
+        "mechanic_counts": mechanic_counts,
+        "today_hourly": hourly,
+    }
+
+def get_admin_stats():
+    return stats_cache.get_or_set('admin', compute_admin_stats)
+
+def invalidate_stats():
+    stats_cache.invalidate('admin')
+
+# ------------------- ANALYTICS -------------------
+ROLLUP_GRAINS = ('hour', 'day')
+GEOHASH_PRECISION = 5
+ANALYTICS_MAX_DAYS = 366
+ANALYTICS_MAX_HOURS = 72
+ANALYTICS_TOP_MECHANICS = 10
+HEATMAP_MAX_CELLS = 5000
+ROLLUP_KEY = ('grain', 'dim', 'dim_key', 'status', 'bucket')
+UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+analytics_cache = SimpleCache(ttl=60)
+
+def truncate(ts, grain):
+    if grain == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def transition(sr, to_status, from_status, mechanic_id=None, actor_id=None, now=None):
+    """Event row for a status change of sr; hand the rows to log_transitions().
+
+    duration is time to assign for 'pending', time to accept (since
+    assignment) for 'accepted' and time to complete (since creation) for
+    'completed'.
+    """
+    now = now or datetime.utcnow()
+    start = None
+    if to_status in ('pending', 'completed'):
+        start = sr.created_at
+    elif to_status == 'accepted':
+        start = sr.assigned_at
+    return {
+        "request_id": sr.id,
+        "from_status": from_status,
+        "to_status": to_status,
+        "mechanic_id": mechanic_id,
+        "actor_id": actor_id,
+        "cell": geohash(sr.lat, sr.lng, GEOHASH_PRECISION) if sr.lat or sr.lng else None,
+        "duration": (now - start).total_seconds() if start else None,
+        "created_at": now,
+    }
+
+def rollup_rows(events):
+    """Fold events into one increment per rollup key."""
+    acc = {}
+    for ev in events:
+        dims = [('all', '')]
+        if ev['mechanic_id']:
+            dims.append(('mechanic', str(ev['mechanic_id'])))
+        if ev['cell']:
+            dims.append(('cell', ev['cell']))
+        for grain in ROLLUP_GRAINS:
+            bucket = truncate(ev['created_at'], grain)
+            for dim, dim_key in dims:
+                key = (grain, dim, dim_key, ev['to_status'], bucket)
+                row = acc.get(key)
+                if row is None:
+                    lat, lng = geohash_center(dim_key) if dim == 'cell' else (None, None)
+                    row = acc[key] = dict(zip(ROLLUP_KEY, key), events=0, duration_sum=0.0, duration_n=0,
+                                          lat=lat, lng=lng)
+                row['events'] += 1
+                if ev['duration'] is not None:
+                    row['duration_sum'] += ev['duration']
+                    row['duration_n'] += 1
+    # A fixed order keeps concurrent upserts from deadlocking on Postgres
+    return [acc[key] for key in sorted(acc)]
+
+def upsert_rollups(rows, conn=None, table=None):
+    """Add rows to the rollups: `table` (default request_rollup) through `conn` (default the session)."""
+    if not rows:
+        return
+    conn = conn if conn is not None else db.session
+    table = table if table is not None else RequestRollup.__table__
+    dialect = getattr(conn, 'dialect', None) or conn.get_bind().dialect
+    make_insert = UPSERTS.get(dialect.name)
+    if make_insert is None:
+        for row in rows:
+            match = db.and_(*(table.c[k] == row[k] for k in ROLLUP_KEY))
+            updated = conn.execute(table.update().where(match).values(
+                events=table.c.events + row['events'],
+                duration_sum=table.c.duration_sum + row['duration_sum'],
+                duration_n=table.c.duration_n + row['duration_n'],
+            )).rowcount
+            if not updated:
+                conn.execute(table.insert(), row)
+        return
+    # Core insert on the table: one executemany, where the ORM would split by which values are NULL
+    stmt = make_insert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=list(ROLLUP_KEY), set_={
+        'events': table.c.events + stmt.excluded.events,
+        'duration_sum': table.c.duration_sum + stmt.excluded.duration_sum,
+        'duration_n': table.c.duration_n + stmt.excluded.duration_n,
+    })
+    conn.execute(stmt, rows)
+
+def fold_events(conn, table, after_id, upto_id=None, batch_size=10000, commit=False):
+    """Fold logged events with after_id < id <= upto_id into `table`; returns how many."""
+    columns = [getattr(RequestEvent, c) for c in
+               ('id', 'to_status', 'mechanic_id', 'cell', 'duration', 'created_at')]
+    folded = 0
+    while True:
+        q = db.select(*columns).where(RequestEvent.id > after_id)
+        if upto_id is not None:
+            q = q.where(RequestEvent.id <= upto_id)
+        rows = conn.execute(q.order_by(RequestEvent.id).limit(batch_size)).all()
+        if not rows:
+            return folded
+        upsert_rollups(rollup_rows(row._asdict() for row in rows), conn=conn, table=table)
+        if commit:
+            conn.commit()
+        folded += len(rows)
+        after_id = rows[-1].id
+
+def rollup_staging_table():
+    """Temporary table shaped like request_rollup, where rebuild-rollups builds the replacement."""
+    columns = [db.Column(c.name, c.type, primary_key=c.primary_key) for c in RequestRollup.__table__.columns]
+    return db.Table('request_rollup_rebuild', db.MetaData(), *columns,
+                    db.Index('ux_rollup_rebuild_bucket', *ROLLUP_KEY, unique=True),
+                    prefixes=['TEMPORARY'])
+
+def log_transitions(events):
+    """Append status-change events and fold them into the rollups. Runs in the
+    caller's transaction; the caller commits."""
+    events = list(events)
+    if not events:
+        return
+    db.session.execute(insert(RequestEvent), events)
+    upsert_rollups(rollup_rows(events))
+
+def analytics_window():
+    """(grain, since) from ?hours= (hourly buckets) or ?days= (daily, default 30)."""
+    hours = request.args.get('hours', type=int)
+    if hours:
+        hours = max(1, min(hours, ANALYTICS_MAX_HOURS))
+        return 'hour', truncate(datetime.utcnow(), 'hour') - timedelta(hours=hours - 1)
+    days = max(1, min(request.args.get('days', default=30, type=int), ANALYTICS_MAX_DAYS))
+    return 'day', truncate(datetime.utcnow(), 'day') - timedelta(days=days - 1)
+
+def compute_analytics(grain, since):
+    """Acceptance rate, average durations, a per-bucket series and the top mechanics, from rollups only."""
+    session = read_session()
+    window = (RequestRollup.grain == grain, RequestRollup.bucket >= since)
+    totals = {status: (n, dsum, dn) for status, n, dsum, dn in session.query(
+        RequestRollup.status, func.sum(RequestRollup.events),
+        func.sum(RequestRollup.duration_sum), func.sum(RequestRollup.duration_n))
+        .filter(*window, RequestRollup.dim == 'all').group_by(RequestRollup.status)}
+
+    def avg(status):
+        _, dsum, dn = totals.get(status, (0, 0, 0))
+        return dsum / dn if dn else None
+
+    def rate(accepted, rejected):
+        return accepted / (accepted + rejected) if accepted + rejected else None
+
+    series = {}
+    for bucket, status, n in session.query(RequestRollup.bucket, RequestRollup.status, func.sum(RequestRollup.events)) \
+            .filter(*window, RequestRollup.dim == 'all').group_by(RequestRollup.bucket, RequestRollup.status):
+        series.setdefault(bucket, dict.fromkeys(STATUSES, 0))[status] = n
+
+    per_mechanic = {}
+    for mech_id, status, n, dsum, dn in session.query(
+            RequestRollup.dim_key, RequestRollup.status, func.sum(RequestRollup.events),
+            func.sum(RequestRollup.duration_sum), func.sum(RequestRollup.duration_n)) \
+            .filter(*window, RequestRollup.dim == 'mechanic').group_by(RequestRollup.dim_key, RequestRollup.status):
+        per_mechanic.setdefault(int(mech_id), {})[status] = (n, dsum, dn)
+    top = sorted(per_mechanic.items(), key=lambda kv: -kv[1].get('completed', (0,))[0])[:ANALYTICS_TOP_MECHANICS]
+    names = dict(session.query(User.id, User.name).filter(User.id.in_([mech_id for mech_id, _ in top])))
+    mechanics = []
+    for mech_id, by_status in top:
+        accepted = by_status.get('accepted', (0, 0, 0))
+        mechanics.append({
+            "id": mech_id,
+            "name": names.get(mech_id),
+            "assigned": by_status.get('pending', (0,))[0],
+            "completed": by_status.get('completed', (0,))[0],
+            "acceptance_rate": rate(accepted[0], by_status.get('rejected', (0,))[0]),
+            "avg_accept_seconds": accepted[1] / accepted[2] if accepted[2] else None,
+        })
+
+    counts = {status: totals[status][0] for status in totals}
+    return {
+        "grain": grain,
+        "since": since.isoformat(),
+        "counts": counts,
+        "acceptance_rate": rate(counts.get('accepted', 0), counts.get('rejected', 0)),
+        "avg_assign_seconds": avg('pending'),
+        "avg_accept_seconds": avg('accepted'),
+        "avg_complete_seconds": avg('completed'),
+        "series": [{"bucket": b.isoformat(), **series[b]} for b in sorted(series)],
+        "mechanics": mechanics,
+    }
+
+@main.cli.command('rebuild-rollups')
+@click.option('--backfill', is_flag=True,
+              help='First log a submitted event for every request that has no events yet.')
+@click.option('--batch-size', default=10000, show_default=True)
+def rebuild_rollups_command(backfill, batch_size):
+    """Recompute the analytics rollups from the request event log."""
+    if backfill:
+        added = last_id = 0
+        while True:
+            rows = db.session.query(ServiceRequest).filter(
+                ServiceRequest.id > last_id,
+                ~db.exists().where(RequestEvent.request_id == ServiceRequest.id)) \
+                .order_by(ServiceRequest.id).limit(batch_size).all()
+            if not rows:
+                break
+            db.session.execute(insert(RequestEvent), [
+                transition(sr, 'submitted', None, actor_id=sr.user_id, now=sr.created_at) for sr in rows])
+            db.session.commit()
+            added += len(rows)
+            last_id = rows[-1].id
+        click.echo(f"Backfilled {added} submitted event(s)")
+
+    # Build the new rollups off to the side from a fixed snapshot of the log, so
+    # analytics keep serving the old totals until the swap
+    live = RequestRollup.__table__
+    staging = rollup_staging_table()
+    copied = [c.name for c in live.columns if c.name != 'id']
+    # Temporary tables belong to one connection, so the whole rebuild uses this one
+    with db.engine.connect() as conn:
+        staging.create(conn)
+        snapshot = conn.execute(db.select(func.max(RequestEvent.id))).scalar() or 0
+        conn.commit()
+        folded = fold_events(conn, staging, 0, snapshot, batch_size, commit=True)
+
+        # Swap in one transaction. Taking the write lock first (the DELETE on
+        # SQLite, an explicit lock elsewhere) stops live log_transitions() calls,
+        # so events logged since the snapshot are folded exactly once, here.
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text(f"LOCK TABLE {live.name} IN EXCLUSIVE MODE"))
+        conn.execute(live.delete())
+        folded += fold_events(conn, staging, snapshot, batch_size=batch_size)
+        conn.execute(live.insert().from_select(copied, db.select(*(staging.c[name] for name in copied))))
+        conn.commit()
+        staging.drop(conn)
+        conn.commit()
+    analytics_cache.invalidate()
+    click.echo(f"Rebuilt rollups from {folded} event(s)")
+
+# ------------------- UPLOADS -------------------
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+
+def upload_store():
+    return current_app.extensions['roadguard_uploads']
+
+def thumbnailer():
+    return current_app.extensions['roadguard_thumbnailer']
+
+def send_upload(path, etag, mimetype):
+    """Serve an immutable upload; its name is its content hash, so caches may keep it forever."""
+    if not os.path.exists(path):
+        abort(404)
+    resp = send_file(path, mimetype=mimetype, conditional=True, etag=etag, max_age=UPLOAD_MAX_AGE)
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    resp.cache_control.immutable = True
+    return resp
 
 # ------------------- ROUTES -------------------
-@app.route('/')
+@main.route('/')
 def index():
     return render_template('index.html')
 
 # --- REGISTER & LOGIN ---
-@app.route('/register', methods=['GET','POST'])
+@main.route('/register', methods=['GET','POST'])
 def register():
     if request.method == 'POST':
         name = request.form['name']
@@ -85,15 +869,17 @@ def register():
         phone = request.form.get('phone', '')
         if User.query.filter_by(email=email).first():
             flash("Email already registered",'warning')
-            return redirect(url_for('register'))
-        user = User(name=name, email=email, password=password, role=role, phone=phone)
+            return redirect(url_for('main.register'))
+        user = User(name=name, email=email, password=password, role=role, phone=phone,
+                    broadcast_read_id=latest_broadcast_id(role))
         db.session.add(user)
         db.session.commit()
+        invalidate_stats()
         flash("Registered! Login now",'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html')
 
-@app.route('/login', methods=['GET','POST'])
+@main.route('/login', methods=['GET','POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
@@ -101,207 +887,549 @@ def login():
         u = User.query.filter_by(email=email, password=password).first()
         if not u:
             flash("Invalid credentials",'danger')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         login_user(u)
         flash("Logged in",'success')
         if u.role == Role.ADMIN.value:
-            return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('main.admin_dashboard'))
         elif u.role == Role.MECHANIC.value:
-            return redirect(url_for('mechanic_dashboard'))
+            return redirect(url_for('main.mechanic_dashboard'))
         else:
-            return redirect(url_for('user_dashboard'))
+            return redirect(url_for('main.user_dashboard'))
     return render_template('login.html')
 
-@app.route('/logout')
+@main.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash("Logged out",'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 # --- USER DASHBOARD ---
-@app.route('/user/dashboard')
+@main.route('/user/dashboard')
 @login_required
 def user_dashboard():
     if current_user.role != Role.USER.value:
         flash("Unauthorized",'danger')
-        return redirect(url_for('index'))
-    requests = ServiceRequest.query.filter_by(user_id=current_user.id).order_by(ServiceRequest.created_at.desc()).all()
-    return render_template('user_dashboard.html', requests=requests)
+        return redirect(url_for('main.index'))
+    # Rows are fetched page by page from /api/requests
+    return render_template('user_dashboard.html', counts=request_counts())
 
-@app.route('/request/new', methods=['GET','POST'])
+@main.route('/request/new', methods=['GET','POST'])
 @login_required
 def new_request():
     if current_user.role != Role.USER.value:
         flash("Unauthorized",'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     if request.method=='POST':
         title = request.form['title']
         description = request.form['description']
         lat = float(request.form['lat'] or 0)
         lng = float(request.form['lng'] or 0)
-        sr = ServiceRequest(user_id=current_user.id, title=title, description=description, lat=lat, lng=lng)
+        image = None
+        upload = request.files.get('image')
+        if upload and upload.filename:
+            try:
+                image = upload_store().save(upload.stream)
+            except UploadError as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('main.user_dashboard'))
+        sr = ServiceRequest(user_id=current_user.id, title=title, description=description, lat=lat, lng=lng,
+                            image=image)
         db.session.add(sr)
+        db.session.flush()
+        message = f"New service request #{sr.id} by {current_user.name}"
+        broadcast(Role.ADMIN.value, message)
+        log_transitions([transition(sr, 'submitted', None, actor_id=current_user.id)])
         db.session.commit()
-
-        # Notify admins
-        admins = User.query.filter_by(role=Role.ADMIN.value).all()
-        for admin in admins:
-            note = Notification(role=Role.ADMIN.value, user_id=admin.id, message=f"New service request #{sr.id} by {current_user.name}")
-            db.session.add(note)
-        db.session.commit()
+        invalidate_stats()
+        publish_request_event("submitted", sr, message, roles=(Role.ADMIN.value,))
+        if image:
+            thumbnailer().submit(image)
 
         flash("Service request submitted",'success')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
     return render_template('request_form.html')
 
 # --- REQUEST DETAIL ---
-@app.route("/request/<int:req_id>")
+@main.route("/request/<int:req_id>")
 @login_required
 def request_detail(req_id):
     req = ServiceRequest.query.get_or_404(req_id)
     if current_user.role == Role.USER.value and req.user_id != current_user.id:
         flash("Unauthorized access", "danger")
-        return redirect(url_for("user_dashboard"))
+        return redirect(url_for("main.user_dashboard"))
     # Pass variable as 'req' so template can use 'req'
     return render_template("request_detail.html", req=req)
 
 # --- ADMIN DASHBOARD ---
-@app.route('/admin/dashboard')
+ADMIN_PENDING_LIMIT = 50
+
+@main.route('/admin/dashboard')
 @login_required
 def admin_dashboard():
     if current_user.role != Role.ADMIN.value:
         flash('Unauthorized','danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
+
+    pending_q = ServiceRequest.query.filter_by(assigned_mechanic_id=None)
+    pending = pending_q.order_by(ServiceRequest.created_at.desc(), ServiceRequest.id.desc()).limit(ADMIN_PENDING_LIMIT).all()
+    pending_total = pending_q.count() if len(pending) == ADMIN_PENDING_LIMIT else len(pending)
+    # Only (id, name): rendered once into a shared datalist, not per pending row
+    mechanics = db.session.query(User.id, User.name).filter(User.role == Role.MECHANIC.value) \
+        .order_by(User.name).all()
 
-    pending = ServiceRequest.query.filter_by(assigned_mechanic_id=None).order_by(ServiceRequest.created_at.desc()).all()
-    all_requests = ServiceRequest.query.order_by(ServiceRequest.created_at.desc()).limit(50).all()
-    mechanics = User.query.filter_by(role=Role.MECHANIC.value).all()
-    users = User.query.filter_by(role=Role.USER.value).all()
+    # Rank free mechanics by distance for each pending request
+    index = get_mechanic_index()
+    mech_by_id = {m.id: m for m in mechanics}
+    nearest = {}
+    for p in pending:
+        if p.lat or p.lng:
+            nearest[p.id] = [(dist, mech_by_id[mid]) for dist, mid in index.nearest(p.lat, p.lng, k=NEAREST_SUGGESTIONS) if mid in mech_by_id]
 
     return render_template(
         'admin_dashboard.html',
         pending=pending,
-        all_requests=all_requests,
+        pending_total=pending_total,
         mechanics=mechanics,
-        users=users,
-        datetime=datetime
+        stats=get_admin_stats(),
+        nearest=nearest
     )
 
+# --- ADMIN STATS API ---
+@main.route('/api/admin/stats')
+@login_required
+def api_admin_stats():
+    if current_user.role != Role.ADMIN.value:
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    return jsonify(get_admin_stats())
+
+# --- ANALYTICS API ---
+@main.route('/api/analytics/summary')
+@login_required
+def api_analytics_summary():
+    if current_user.role != Role.ADMIN.value:
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    grain, since = analytics_window()
+    return jsonify(analytics_cache.get_or_set(('summary', grain, since), lambda: compute_analytics(grain, since)))
+
+@main.route('/api/analytics/heatmap')
+@login_required
+def api_analytics_heatmap():
+    """Event counts per geohash cell inside ?bbox=west,south,east,north (Leaflet's toBBoxString())."""
+    if current_user.role != Role.ADMIN.value:
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    try:
+        west, south, east, north = (float(v) for v in request.args['bbox'].split(','))
+    except (KeyError, ValueError):
+        return jsonify({"success": False, "message": "bbox=west,south,east,north required"}), 400
+    status = request.args.get('status', 'submitted')
+    precision = max(1, min(request.args.get('precision', default=GEOHASH_PRECISION, type=int), GEOHASH_PRECISION))
+    grain, since = analytics_window()
+
+    # Rollup cells are matched on their centre; pad by half a cell so ones straddling the edge count
+    bits = GEOHASH_PRECISION * 5
+    pad_lat, pad_lng = 90 / 2 ** (bits // 2), 180 / 2 ** ((bits + 1) // 2)
+    rows = read_session().query(RequestRollup.dim_key, func.sum(RequestRollup.events)).filter(
+        RequestRollup.grain == grain, RequestRollup.dim == 'cell', RequestRollup.status == status,
+        RequestRollup.bucket >= since,
+        RequestRollup.lat.between(south - pad_lat, north + pad_lat),
+        RequestRollup.lng.between(west - pad_lng, east + pad_lng),
+    ).group_by(RequestRollup.dim_key)
+
+    cells = {}
+    for cell, n in rows:
+        cells[cell[:precision]] = cells.get(cell[:precision], 0) + n
+    top = sorted(cells.items(), key=lambda kv: -kv[1])[:HEATMAP_MAX_CELLS]
+    out = []
+    for cell, n in top:
+        lat, lng = geohash_center(cell)
+        out.append({"cell": cell, "lat": lat, "lng": lng, "count": n})
+    return jsonify({"success": True, "status": status, "grain": grain, "since": since.isoformat(),
+                    "precision": precision, "truncated": len(cells) > len(top), "cells": out})
+
+# --- REQUESTS API ---
+REQUESTS_PAGE_SIZE = 20
+
+def scoped_requests():
+    """Requests the current user may list: their own, their assignments, or all for admins."""
+    q = ServiceRequest.query
+    if current_user.role == Role.USER.value:
+        q = q.filter(ServiceRequest.user_id == current_user.id)
+    elif current_user.role == Role.MECHANIC.value:
+        q = q.filter(ServiceRequest.assigned_mechanic_id == current_user.id)
+    return q
+
+def request_counts():
+    counts = dict(scoped_requests().with_entities(ServiceRequest.status, func.count(ServiceRequest.id))
+                  .group_by(ServiceRequest.status).all())
+    counts['all'] = sum(counts.values())
+    return counts
+
+@main.route('/api/requests')
+@login_required
+def api_requests():
+    q = scoped_requests()
+    statuses = [st for st in request.args.getlist('status') if st]
+    if statuses:
+        q = q.filter(ServiceRequest.status.in_(statuses))
+    if request.args.get('before'):
+        try:
+            q = q.filter(older_than(ServiceRequest, decode_cursor(request.args['before'])))
+        except ValueError:
+            return jsonify({"success": False, "message": "Invalid cursor"}), 400
+    limit = max(1, min(request.args.get('limit', default=REQUESTS_PAGE_SIZE, type=int), 100))
+    rows = q.options(joinedload(ServiceRequest.user), joinedload(ServiceRequest.mechanic)) \
+        .order_by(ServiceRequest.created_at.desc(), ServiceRequest.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return jsonify({"success": True, "requests": [r.to_dict() for r in rows[:limit]], "next": next_cursor})
+
+@main.route('/api/requests/counts')
+@login_required
+def api_request_counts():
+    return jsonify({"success": True, "counts": request_counts()})
+
 # --- PROFILE UPDATE ---
-@app.route('/user/profile/update', methods=['POST'])
+@main.route('/user/profile/update', methods=['POST'])
 @login_required
 def update_profile():
     if current_user.role != Role.USER.value:
         flash("Unauthorized",'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     current_user.name = request.form.get('name')
     current_user.email = request.form.get('email')
     current_user.phone = request.form.get('phone')
     db.session.commit()
     flash("Profile updated successfully",'success')
-    return redirect(url_for('user_dashboard'))
+    return redirect(url_for('main.user_dashboard'))
 
 # --- ADMIN ASSIGN MECHANIC ---
-@app.route("/admin/assign", methods=["POST"])
+@main.route("/admin/assign", methods=["POST"])
 @login_required
 def admin_assign():
     if current_user.role != Role.ADMIN.value:
         flash("Unauthorized","danger")
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
     req_id = request.form.get("req_id")
-    mech_id = request.form.get("mech_id")
+    # A name typed into the all-mechanics search wins over the nearest-mechanics select
+    mech_id = picked_mechanic_id(request.form.get("mech_search")) or picked_mechanic_id(request.form.get("mech_id"))
     sr = ServiceRequest.query.get_or_404(req_id)
-    sr.assigned_mechanic_id = int(mech_id)
+    mech = db.session.get(User, mech_id) if mech_id else None
+    if mech is None or mech.role != Role.MECHANIC.value:
+        flash("Choose a mechanic from the list",'danger')
+        return redirect(url_for("main.admin_dashboard"))
+    previous = sr.status
+    sr.assigned_mechanic_id = mech.id
+    sr.assigned_at = datetime.utcnow()
     sr.status = "pending"
+    log_transitions([transition(sr, "pending", previous, mechanic_id=sr.assigned_mechanic_id,
+                                actor_id=current_user.id, now=sr.assigned_at)])
+    notify([{"role": Role.MECHANIC.value, "user_id": sr.assigned_mechanic_id, "message": f"Request #{sr.id} assigned to you"}])
     db.session.commit()
-    mech = User.query.get(mech_id)
-    note = Notification(role=Role.MECHANIC.value, user_id=mech.id, message=f"Request #{sr.id} assigned to you")
-    db.session.add(note)
-    db.session.commit()
+    if mechanic_index.loaded:
+        mechanic_index.set_busy(sr.assigned_mechanic_id)
+    invalidate_stats()
+    publish_request_event("assigned", sr, f"Request #{sr.id} assigned to {sr.mechanic.name}",
+                          user_ids=(sr.user_id, sr.assigned_mechanic_id))
     flash(f"Request #{sr.id} assigned",'success')
-    return redirect(url_for("admin_dashboard"))
+    return redirect(url_for("main.admin_dashboard"))
+
+# --- ADMIN AUTO DISPATCH ---
+@main.route("/admin/dispatch", methods=["POST"])
+@login_required
+def admin_dispatch():
+    if current_user.role != Role.ADMIN.value:
+        flash("Unauthorized","danger")
+        return redirect(url_for("main.index"))
+    max_km = request.form.get("max_km", type=float)
+    load_cap = request.form.get("load_cap", default=DISPATCH_LOAD_CAP, type=int)
+    assignments = run_dispatch(load_cap=load_cap, max_km=max_km)
+    flash(f"Auto-dispatch assigned {len(assignments)} request(s)", 'success' if assignments else 'info')
+    return redirect(url_for("main.admin_dashboard"))
 
 # --- MECHANIC DASHBOARD ---
-@app.route('/mechanic/dashboard')
+@main.route('/mechanic/dashboard')
 @login_required
 def mechanic_dashboard():
     if current_user.role != Role.MECHANIC.value:
         flash("Unauthorized",'danger')
-        return redirect(url_for('index'))
-    assigned = ServiceRequest.query.filter_by(assigned_mechanic_id=current_user.id).order_by(ServiceRequest.created_at.desc()).all()
-    return render_template('mechanic_dashboard.html', assigned=assigned)
+        return redirect(url_for('main.index'))
+    # Cards are fetched page by page from /api/requests
+    return render_template('mechanic_dashboard.html', counts=request_counts())
 
 # --- MECHANIC RESPOND ---
-@app.route("/mechanic/respond/<int:req_id>", methods=["POST"])
+@main.route("/mechanic/respond/<int:req_id>", methods=["POST"])
 @login_required
 def mechanic_respond(req_id):
     if current_user.role != Role.MECHANIC.value:
         flash("Unauthorized","danger")
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
     req = ServiceRequest.query.get_or_404(req_id)
     if req.assigned_mechanic_id != current_user.id:
         flash("Not assigned to you","danger")
-        return redirect(url_for("mechanic_dashboard"))
+        return redirect(url_for("main.mechanic_dashboard"))
 
     action = request.form.get("action")
     comment = request.form.get("comment")
+    message = None
+    previous = req.status
     if action=="accept":
         req.status="accepted"
-        note = Notification(role=Role.USER.value,user_id=req.user_id,message=f"Your request #{req.id} accepted by {current_user.name}")
-        db.session.add(note)
+        message = f"Your request #{req.id} accepted by {current_user.name}"
+        notify([{"role": Role.USER.value, "user_id": req.user_id, "message": message}])
     elif action=="reject":
         req.status="rejected"
         req.assigned_mechanic_id=None
-        for admin in User.query.filter_by(role=Role.ADMIN.value).all():
-            note = Notification(role=Role.ADMIN.value, user_id=admin.id, message=f"Request #{req.id} rejected by {current_user.name}")
-            db.session.add(note)
+        message = f"Request #{req.id} rejected by {current_user.name}"
+        broadcast(Role.ADMIN.value, message)
     elif action=="start":
         req.status="enroute"
-        note = Notification(role=Role.USER.value,user_id=req.user_id,message=f"Mechanic {current_user.name} en route for request #{req.id}")
-        db.session.add(note)
+        message = f"Mechanic {current_user.name} en route for request #{req.id}"
+        notify([{"role": Role.USER.value, "user_id": req.user_id, "message": message}])
     elif action=="complete":
         req.status="completed"
-        note = Notification(role=Role.USER.value,user_id=req.user_id,message=f"Your request #{req.id} completed by {current_user.name}")
-        db.session.add(note)
+        message = f"Your request #{req.id} completed by {current_user.name}"
+        notify([{"role": Role.USER.value, "user_id": req.user_id, "message": message}])
 
     if comment:
         req.mechanic_response=comment
+    if req.status != previous:
+        log_transitions([transition(req, req.status, previous, mechanic_id=current_user.id,
+                                    actor_id=current_user.id)])
     db.session.commit()
-    return redirect(url_for("mechanic_dashboard"))
+    invalidate_stats()
+    if action in ("reject", "complete"):
+        refresh_mechanic_busy(current_user.id)
+    if message:
+        publish_request_event(req.status, req, message, user_ids=(req.user_id, current_user.id),
+                              roles=(Role.ADMIN.value,) if action == "reject" else ())
+    return redirect(url_for("main.mechanic_dashboard"))
+
+# --- MECHANIC LOCATION ---
+@main.route("/mechanic/location", methods=["POST"])
+@login_required
+def mechanic_location():
+    if current_user.role != Role.MECHANIC.value:
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    data = request.get_json(silent=True) or request.form
+    try:
+        lat = float(data.get("lat"))
+        lng = float(data.get("lng"))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "lat and lng required"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"success": False, "message": "Coordinates out of range"}), 400
+    current_user.lat = lat
+    current_user.lng = lng
+    current_user.location_updated_at = datetime.utcnow()
+    db.session.commit()
+    if mechanic_index.loaded:
+        mechanic_index.update(current_user.id, lat, lng)
+    return jsonify({"success": True})
+
+# --- NEAREST MECHANICS API ---
+@main.route("/api/mechanics/nearest")
+@login_required
+def api_nearest_mechanics():
+    if current_user.role != Role.ADMIN.value:
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    k = request.args.get("k", default=5, type=int)
+    if lat is None or lng is None:
+        return jsonify({"success": False, "message": "lat and lng required"}), 400
+    k = max(1, min(k, 100))
+    hits = get_mechanic_index().nearest(lat, lng, k=k)
+    mechs = {m.id: m for m in User.query.filter(User.id.in_([mid for _, mid in hits]))}
+    return jsonify({"success": True, "mechanics": [
+        {
+            "id": mid,
+            "name": mechs[mid].name,
+            "phone": mechs[mid].phone,
+            "lat": mechs[mid].lat,
+            "lng": mechs[mid].lng,
+            "distance_km": round(dist, 3),
+        }
+        for dist, mid in hits if mid in mechs
+    ]})
 
 # --- NOTIFICATIONS ---
-@app.route('/notifications')
+@main.route('/notifications')
 @login_required
 def notifications():
-    notes = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.created_at.desc()).all()
-    return render_template('notifications.html', notifications=notes)
+    # Keyset pagination on (created_at, id)
+    before = None
+    cursor = request.args.get('before')
+    if cursor:
+        try:
+            before = decode_cursor(cursor)
+        except ValueError:
+            return redirect(url_for('main.notifications'))
+    notes = notification_feed(current_user, before, limit=NOTIFICATIONS_PER_PAGE + 1)
+    next_cursor = None
+    if len(notes) > NOTIFICATIONS_PER_PAGE:
+        notes = notes[:NOTIFICATIONS_PER_PAGE]
+        next_cursor = encode_cursor(notes[-1])
+    unread = current_user.unread_notifications + unread_broadcast_count(current_user)
+    return render_template('notifications.html', notifications=notes, next_cursor=next_cursor, unread=unread)
+
+@main.route('/notifications/read', methods=['POST'])
+@login_required
+def notifications_read():
+    ids = request.form.getlist('ids', type=int) or None
+    mark_notifications_read(current_user, ids)
+    return redirect(request.referrer or url_for('main.notifications'))
+
+# --- LIVE EVENTS (SSE) ---
+@main.route('/events')
+@login_required
+def events_stream():
+    # Needs a threaded or async worker: each open stream holds one while connected
+    sub = broker.subscribe([f"user:{current_user.id}", f"role:{current_user.role}"])
+    return Response(sse_stream(sub), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- UPLOADED IMAGES ---
+@main.route('/uploads/<name>')
+@login_required
+def upload_file(name):
+    store = upload_store()
+    if not store.valid_name(name):
+        abort(404)
+    return send_upload(store.path(name), name.rsplit('.', 1)[0], MIMETYPES[name.rsplit('.', 1)[1]])
+
+@main.route('/uploads/<variant>/<name>')
+@login_required
+def upload_variant(variant, name):
+    store = upload_store()
+    if variant not in VARIANTS or not store.valid_name(name):
+        abort(404)
+    path = store.variant_path(name, variant)
+    if os.path.exists(path):
+        return send_upload(path, f"{variant}-{name.rsplit('.', 1)[0]}", 'image/jpeg')
+    # Not built yet (or Pillow is missing): queue it and send the original uncached meanwhile
+    thumbnailer().submit(name)
+    if not os.path.exists(store.path(name)):
+        abort(404)
+    resp = send_file(store.path(name), mimetype=MIMETYPES[name.rsplit('.', 1)[1]], conditional=True)
+    resp.cache_control.no_cache = True
+    return resp
+
+@main.app_errorhandler(413)
+def upload_too_large(e):
+    flash(f"Images must be under {current_app.config['UPLOAD_MAX_BYTES'] // (1024 * 1024)} MB", 'danger')
+    return redirect(request.referrer or url_for('main.index'))
 
 # --- ADMIN DOWNLOAD REPORT ---
-@app.route('/admin/download_report')
+REPORT_CHUNK_ROWS = 1000
+
+@main.route('/admin/download_report')
 @login_required
 def admin_download_report():
     if current_user.role != Role.ADMIN.value:
         flash("Unauthorized","danger")
-        return redirect(url_for("index"))
-
-    requests = ServiceRequest.query.all()
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(['ID','Title','Status','User','Mechanic','Created At'])
-    for r in requests:
-        cw.writerow([
-            r.id,
-            r.title,
-            r.status,
-            r.user.name if r.user else '',
-            r.mechanic.name if r.mechanic else '',
-            r.created_at.strftime('%d-%b-%Y %H:%M')
-        ])
-    output = si.getvalue()
-    return Response(output,mimetype="text/csv", headers={"Content-Disposition":"attachment;filename=all_requests_report.csv"})
+        return redirect(url_for("main.index"))
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in report.FORMATS:
+        flash("Unknown report format","danger")
+        return redirect(url_for("main.admin_dashboard"))
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') if request.args.get('end') else None
+    except ValueError:
+        flash("Dates must be YYYY-MM-DD","danger")
+        return redirect(url_for("main.admin_dashboard"))
+
+    # Names come from joins so rows never lazy-load r.user / r.mechanic
+    requester = aliased(User)
+    mechanic = aliased(User)
+    stmt = db.select(
+        ServiceRequest.id, ServiceRequest.title, ServiceRequest.status, ServiceRequest.created_at,
+        requester.name.label('user'), mechanic.name.label('mechanic'),
+    ).outerjoin(requester, ServiceRequest.user_id == requester.id) \
+     .outerjoin(mechanic, ServiceRequest.assigned_mechanic_id == mechanic.id) \
+     .order_by(ServiceRequest.id)
+    if start:
+        stmt = stmt.where(ServiceRequest.created_at >= start)
+    if end:
+        stmt = stmt.where(ServiceRequest.created_at < end + timedelta(days=1))
+    statuses = [st for st in request.args.getlist('status') if st]
+    if statuses:
+        stmt = stmt.where(ServiceRequest.status.in_(statuses))
+    mech_id = picked_mechanic_id(request.args.get('mechanic_id'))
+    if mech_id:
+        stmt = stmt.where(ServiceRequest.assigned_mechanic_id == mech_id)
+
+    encode, mimetype = report.FORMATS[fmt]
+    filename = f"requests_report.{fmt}"
+
+    def generate():
+        result = read_session().execute(stmt.execution_options(yield_per=REPORT_CHUNK_ROWS))
+        yield from encode(result.partitions())
+
+    body = generate()
+    if request.args.get('gzip'):
+        body = report.gzip_chunks(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment;filename={filename}"})
+
+# ------------------- APP FACTORY -------------------
+def create_app(config=None):
+    """Build the app; `config` overrides the environment-derived settings."""
+    config = config or {}
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY=os.environ.get('ROADGUARD_SECRET', 'dev-secret'),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # Requests issuing more SQL statements than this get a warning in the log
+        QUERY_BUDGET=int(os.environ.get('ROADGUARD_QUERY_BUDGET', 25)),
+        # Optional bearer token required to scrape /metrics
+        METRICS_TOKEN=os.environ.get('ROADGUARD_METRICS_TOKEN'),
+        **database_config(config.get('DATABASE_URL'), config.get('DATABASE_REPLICA_URL')),
+        UPLOAD_FOLDER=os.environ.get('ROADGUARD_UPLOAD_DIR', os.path.join(app.instance_path, 'uploads')),
+        UPLOAD_MAX_BYTES=int(os.environ.get('ROADGUARD_MAX_UPLOAD_MB', 10)) * 1024 * 1024,
+        THUMBNAIL_WORKERS=int(os.environ.get('ROADGUARD_THUMBNAIL_WORKERS', 2)),
+        # Outgoing mail for OTPs
+        SMTP_SERVER=os.environ.get('ROADGUARD_SMTP_SERVER', 'smtp.gmail.com'),
+        SMTP_PORT=int(os.environ.get('ROADGUARD_SMTP_PORT', 587)),
+        SMTP_STARTTLS=os.environ.get('ROADGUARD_SMTP_STARTTLS', '1') == '1',
+        EMAIL_ADDRESS=os.environ.get('ROADGUARD_EMAIL_ADDRESS', 'rawatvaibhav27@gmail.com'),
+        EMAIL_PASSWORD=os.environ.get('ROADGUARD_EMAIL_PASSWORD', ''),
+        MAIL_WORKERS=int(os.environ.get('ROADGUARD_MAIL_WORKERS', 4)),
+        MAIL_QUEUE_SIZE=int(os.environ.get('ROADGUARD_MAIL_QUEUE_SIZE', 1000)),
+        # OTP codes and their rate limits: sqlite:///path shared by every worker on the host, or memory://
+        OTP_STORE_URL=os.environ.get('ROADGUARD_OTP_STORE', 'sqlite:///' + os.path.join(app.instance_path, 'otp.db')),
+    )
+    app.config.update(config)
+    # Headroom for the other form fields sent with the image
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        app.config['MAX_CONTENT_LENGTH'] = app.config['UPLOAD_MAX_BYTES'] + 1024 * 1024
+
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine)
+    metrics.init_app(app, db)
+    login_manager.init_app(app)
+    app.register_blueprint(main)
+    app.register_blueprint(otp_bp)
+    otp.init_app(app)
+    app.teardown_appcontext(close_read_session)
+    store = UploadStore(app.config['UPLOAD_FOLDER'], max_bytes=app.config['UPLOAD_MAX_BYTES'])
+    app.extensions['roadguard_uploads'] = store
+    thumbnailer = Thumbnailer(store, workers=app.config['THUMBNAIL_WORKERS'])
+    if not thumbnailer.available:
+        app.logger.warning("Pillow is not installed; request photos are served full size without thumbnails")
+    app.extensions['roadguard_thumbnailer'] = thumbnailer
+    return app
 
 # --- RUN APP ---
 if __name__=="__main__":
+    app = create_app()
+    with app.app_context():
+        init_db()
     app.run(debug=True)
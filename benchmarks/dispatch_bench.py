@@ -0,0 +1,49 @@
+"""Solve-time benchmark for the batch dispatch engine.
+
+Run from the repo root:  python -m benchmarks.dispatch_bench [--requests 500]
+"""
+import argparse
+import time
+
+import numpy as np
+
+import dispatch
+
+FLEETS = (1_000, 10_000, 50_000)
+
+def synthetic(n, rng):
+    """Random points over a metro-sized box (~60 x 60 km around Delhi)."""
+    return rng.uniform(28.3, 28.9, n), rng.uniform(76.9, 77.5, n)
+
+def run(fleet, n_requests, load_cap, method, seed=0):
+    rng = np.random.default_rng(seed)
+    mech_lat, mech_lng = synthetic(fleet, rng)
+    req_lat, req_lng = synthetic(n_requests, rng)
+    capacity = np.full(fleet, load_cap)
+    start = time.perf_counter()
+    match, km = dispatch.solve(req_lat, req_lng, mech_lat, mech_lng, capacity, method=method)
+    elapsed = time.perf_counter() - start
+    assigned = match >= 0
+    return {
+        "fleet": fleet,
+        "requests": n_requests,
+        "assigned": int(assigned.sum()),
+        "mean_km": float(km[assigned].mean()) if assigned.any() else 0.0,
+        "seconds": elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="pending requests per run")
+    parser.add_argument("--load-cap", type=int, default=1)
+    parser.add_argument("--method", choices=sorted(dispatch.MATCHERS), default="greedy")
+    parser.add_argument("--fleets", type=int, nargs="+", default=list(FLEETS))
+    args = parser.parse_args()
+
+    print(f"{'fleet':>8} {'requests':>9} {'assigned':>9} {'mean km':>8} {'solve ms':>9}")
+    for fleet in args.fleets:
+        r = run(fleet, args.requests, args.load_cap, args.method)
+        print(f"{r['fleet']:>8} {r['requests']:>9} {r['assigned']:>9} {r['mean_km']:>8.2f} {r['seconds'] * 1000:>9.1f}")
+
+if __name__ == "__main__":
+    main()
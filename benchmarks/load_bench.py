@@ -0,0 +1,367 @@
+"""Load test for the full request lifecycle against a seeded SQLite database.
+
+Seeds (once, then reused) a database with users, mechanics, service requests
+and notifications, then drives the real routes through the Flask test client
+from several processes: register, login, new request, dashboards, assign,
+mechanic accept/start/complete, notifications and the report export. Reports
+throughput, p50/p95/p99 latency and SQL queries per request for every step,
+writes the results as JSON and compares them with a previous run.
+
+Run from the repo root:
+    python -m benchmarks.load_bench [--clients 8] [--iterations 20]
+    python -m benchmarks.load_bench --baseline instance/loadtest-baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+PASSWORD = "bench"
+SEED_BATCH = 50_000
+# Metro-sized box (~60 x 60 km around Delhi), same as the dispatch benchmark
+LAT_RANGE = (28.3, 28.9)
+LNG_RANGE = (76.9, 77.5)
+SEED_DAYS = 365
+SEED_STATUSES = ("submitted", "pending", "accepted", "enroute", "completed", "rejected")
+SEED_STATUS_WEIGHTS = (0.04, 0.02, 0.02, 0.02, 0.85, 0.05)
+
+# Differences smaller than this are noise, whatever the percentage says
+NOISE_FLOOR_MS = 2.0
+
+# ----------------- Seeding -----------------
+def _seed_meta_path(db_path):
+    return db_path + ".seed.json"
+
+def seed(db_path, users, mechanics, requests, notifications, rng_seed=0):
+    """Populate db_path unless it already holds a seed with the same shape."""
+    meta = {"users": users, "mechanics": mechanics, "requests": requests,
+            "notifications": notifications, "seed": rng_seed}
+    meta_path = _seed_meta_path(db_path)
+    if os.path.exists(db_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                print(f"Reusing seeded database {db_path}")
+                return
+    for path in (db_path, db_path + "-wal", db_path + "-shm", meta_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    from sqlalchemy import insert
+    from app import create_app, init_db, db, User, ServiceRequest, Notification, Role
+
+    app = create_app()
+
+    rng = np.random.default_rng(rng_seed)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+
+    def created_at(n):
+        offsets = np.sort(rng.uniform(0, SEED_DAYS * 86400, n))[::-1]
+        return [now - timedelta(seconds=float(s)) for s in offsets]
+
+    def insert_batches(model, total, make_rows):
+        for lo in range(0, total, SEED_BATCH):
+            n = min(SEED_BATCH, total - lo)
+            db.session.execute(insert(model), make_rows(lo, n))
+            db.session.commit()
+        print(f"  {model.__tablename__}: {total:,} rows ({time.perf_counter() - started:.0f}s)")
+
+    with app.app_context():
+        init_db()
+        # The admin seeded by init_db() takes id 1
+        first_user_id = db.session.query(db.func.max(User.id)).scalar() + 1
+        insert_batches(User, users, lambda lo, n: [
+            {"name": f"User {lo + i}", "email": f"user{lo + i}@bench.local", "password": PASSWORD,
+             "role": Role.USER.value, "phone": f"9{lo + i:09d}"}
+            for i in range(n)
+        ])
+        first_mech_id = first_user_id + users
+        lat = rng.uniform(*LAT_RANGE, mechanics)
+        lng = rng.uniform(*LNG_RANGE, mechanics)
+        insert_batches(User, mechanics, lambda lo, n: [
+            {"name": f"Mechanic {lo + i}", "email": f"mech{lo + i}@bench.local", "password": PASSWORD,
+             "role": Role.MECHANIC.value, "lat": float(lat[lo + i]), "lng": float(lng[lo + i]),
+             "location_updated_at": now}
+            for i in range(n)
+        ])
+
+        def request_rows(lo, n):
+            status = rng.choice(SEED_STATUSES, n, p=SEED_STATUS_WEIGHTS)
+            user_id = rng.integers(first_user_id, first_user_id + users, n)
+            mech_id = rng.integers(first_mech_id, first_mech_id + mechanics, n)
+            req_lat = rng.uniform(*LAT_RANGE, n)
+            req_lng = rng.uniform(*LNG_RANGE, n)
+            return [
+                {"user_id": int(user_id[i]), "title": f"Breakdown {lo + i}", "description": "Seeded request",
+                 "lat": float(req_lat[i]), "lng": float(req_lng[i]), "status": str(status[i]),
+                 "created_at": ts,
+                 "assigned_mechanic_id": None if status[i] in ("submitted", "rejected") else int(mech_id[i])}
+                for i, ts in enumerate(created_at(n))
+            ]
+        insert_batches(ServiceRequest, requests, request_rows)
+
+        def notification_rows(lo, n):
+            user_id = rng.integers(first_user_id, first_user_id + users, n)
+            is_read = rng.random(n) < 0.8
+            return [
+                {"role": Role.USER.value, "user_id": int(user_id[i]), "message": f"Seeded notification {lo + i}",
+                 "created_at": ts, "is_read": bool(is_read[i])}
+                for i, ts in enumerate(created_at(n))
+            ]
+        insert_batches(Notification, notifications, notification_rows)
+
+        db.session.execute(db.text(
+            'UPDATE "user" SET unread_notifications = (SELECT COUNT(*) FROM notification '
+            'WHERE notification.user_id = "user".id AND notification.is_read = 0)'
+        ))
+        db.session.commit()
+        db.session.execute(db.text("ANALYZE"))
+        db.session.commit()
+
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    print(f"Seeded {db_path} in {time.perf_counter() - started:.0f}s")
+
+# ----------------- Client scenarios -----------------
+class QueryCounter:
+    """Counts SQL statements on the app's engines in this process.
+
+    The Server-Timing query count is fixed in after_request, before a streamed
+    body (the report export) runs its queries; counting at the engine after
+    the body is drained covers those too.
+    """
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+class Client:
+    """One simulated browser session that records a sample per request."""
+
+    def __init__(self, app, samples, queries):
+        self.http = app.test_client()
+        self.samples = samples
+        self.queries = queries
+
+    def call(self, step, method, url, **kwargs):
+        before = self.queries.count
+        start = time.perf_counter()
+        resp = self.http.open(url, method=method, **kwargs)
+        resp.get_data()  # drain streamed bodies so the whole export is timed and counted
+        elapsed = time.perf_counter() - start
+        # login_required bounces to /login?next=...
+        ok = resp.status_code < 400 and "/login?" not in resp.headers.get("Location", "")
+        self.samples.append((step, elapsed, self.queries.count - before, ok))
+        return resp
+
+    def login(self, email, password=PASSWORD):
+        resp = self.call("POST /login", "POST", "/login", data={"email": email, "password": password})
+        if resp.headers.get("Location", "").endswith("/login"):
+            raise RuntimeError(f"login failed for {email}")
+        return resp
+
+def lifecycle(app, samples, queries, rng, token, n, mechanics):
+    """One request from registration to completion, plus the reads around it."""
+    from app import Role
+
+    user = Client(app, samples, queries)
+    email = f"load-{token}-{n}@bench.local"
+    user.call("GET /register", "GET", "/register")
+    user.call("POST /register", "POST", "/register", data={
+        "name": f"Load {n}", "email": email, "password": PASSWORD, "role": Role.USER.value, "phone": "9000000000",
+    })
+    user.login(email)
+    user.call("GET /user/dashboard", "GET", "/user/dashboard")
+    user.call("POST /request/new", "POST", "/request/new", data={
+        "title": "Flat tyre", "description": "Load test request",
+        "lat": str(rng.uniform(*LAT_RANGE)), "lng": str(rng.uniform(*LNG_RANGE)),
+    })
+    page = user.call("GET /api/requests", "GET", "/api/requests?limit=1").get_json()
+    req_id = page["requests"][0]["id"]
+
+    admin = Client(app, samples, queries)
+    admin.login("admin@roadguard.local", "admin")
+    admin.call("GET /admin/dashboard", "GET", "/admin/dashboard")
+    admin.call("GET /api/admin/stats", "GET", "/api/admin/stats")
+    mech = mechanics[int(rng.integers(len(mechanics)))]
+    admin.call("POST /admin/assign", "POST", "/admin/assign", data={"req_id": req_id, "mech_id": mech.id})
+
+    mechanic = Client(app, samples, queries)
+    mechanic.login(mech.email)
+    mechanic.call("GET /mechanic/dashboard", "GET", "/mechanic/dashboard")
+    mechanic.call("GET /api/requests", "GET", "/api/requests")
+    for action in ("accept", "start", "complete"):
+        mechanic.call(f"POST /mechanic/respond {action}", "POST", f"/mechanic/respond/{req_id}",
+                      data={"action": action, "comment": ""})
+
+    user.call("GET /request/<id>", "GET", f"/request/{req_id}")
+    user.call("GET /notifications", "GET", "/notifications")
+    mechanic.call("GET /notifications", "GET", "/notifications")
+    admin.call("GET /notifications", "GET", "/notifications")
+
+    # A one-day export keeps the report step comparable across seed sizes
+    day = (datetime.utcnow() - timedelta(days=int(rng.integers(1, SEED_DAYS)))).strftime("%Y-%m-%d")
+    admin.call("GET /admin/download_report", "GET", f"/admin/download_report?start={day}&end={day}")
+
+def run_client(args):
+    """Worker entry point: import the app against the bench DB and run the scenario."""
+    db_url, worker, iterations, warmup, seed = args
+    os.environ["DATABASE_URL"] = db_url
+    import logging
+    logging.getLogger("metrics").setLevel(logging.ERROR)  # the budget warning would flood stderr
+    from app import create_app, db, Role, User
+
+    app = create_app()
+    rng = np.random.default_rng(seed + worker)
+    token = f"{uuid.uuid4().hex[:8]}-{worker}"
+    with app.app_context():
+        mechanics = User.query.filter_by(role=Role.MECHANIC.value).with_entities(User.id, User.email).all()
+        queries = QueryCounter(db.engines.values())
+
+    for i in range(warmup):
+        lifecycle(app, [], queries, rng, token, -1 - i, mechanics)
+    samples = []
+    started = time.time()
+    for i in range(iterations):
+        lifecycle(app, samples, queries, rng, token, i, mechanics)
+    return started, time.time(), samples
+
+# ----------------- Reporting -----------------
+def summarize(samples, wall):
+    steps = {}
+    for step, elapsed, queries, ok in samples:
+        steps.setdefault(step, []).append((elapsed, queries, ok))
+    routes = {}
+    for step in sorted(steps):
+        rows = steps[step]
+        ms = np.array([r[0] for r in rows]) * 1000
+        queries = np.array([r[1] for r in rows if r[1] >= 0])
+        routes[step] = {
+            "count": len(rows),
+            "errors": sum(1 for r in rows if not r[2]),
+            "rps": len(rows) / wall,
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "queries_mean": float(queries.mean()) if queries.size else None,
+            "queries_max": int(queries.max()) if queries.size else None,
+        }
+    return routes
+
+def compare(routes, baseline, tolerance):
+    """Steps whose p95 latency or query count got worse than the baseline."""
+    regressions = []
+    for step, cur in routes.items():
+        base = baseline.get("routes", {}).get(step)
+        if not base:
+            continue
+        slower = cur["p95_ms"] - base["p95_ms"]
+        if slower > NOISE_FLOOR_MS and cur["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append({"route": step, "metric": "p95_ms", "baseline": base["p95_ms"], "current": cur["p95_ms"]})
+        if cur["queries_mean"] is not None and base.get("queries_mean") is not None \
+                and cur["queries_mean"] > base["queries_mean"] + 0.5:
+            regressions.append({"route": step, "metric": "queries_mean",
+                                "baseline": base["queries_mean"], "current": cur["queries_mean"]})
+        if cur["errors"] > base.get("errors", 0):
+            regressions.append({"route": step, "metric": "errors", "baseline": base.get("errors", 0),
+                                "current": cur["errors"]})
+    return regressions
+
+def print_table(routes, baseline):
+    base_routes = baseline.get("routes", {}) if baseline else {}
+    print(f"{'route':<34} {'n':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'queries':>8} {'p95 vs base':>12}")
+    for step, r in routes.items():
+        base = base_routes.get(step)
+        delta = f"{(r['p95_ms'] / base['p95_ms'] - 1) * 100:+.0f}%" if base and base["p95_ms"] else ""
+        queries = f"{r['queries_mean']:.1f}" if r["queries_mean"] is not None else "-"
+        print(f"{step:<34} {r['count']:>6} {r['errors']:>4} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} "
+              f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {queries:>8} {delta:>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.path.join("instance", "loadtest.db"), help="seeded SQLite file")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--mechanics", type=int, default=5_000)
+    parser.add_argument("--requests", type=int, default=1_000_000)
+    parser.add_argument("--notifications", type=int, default=1_000_000)
+    parser.add_argument("--clients", type=int, default=8, help="worker processes, one simulated client each")
+    parser.add_argument("--iterations", type=int, default=20, help="request lifecycles per client")
+    parser.add_argument("--warmup", type=int, default=1, help="unrecorded lifecycles per client")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=os.path.join("instance", "loadtest-results.json"))
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown vs the baseline")
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    db_url = f"sqlite:///{db_path}"
+    # Seed in a child so this process never holds the app's engine across the fork
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        pool.apply(_seed_with_url, (db_url, db_path, args.users, args.mechanics, args.requests,
+                                    args.notifications, args.seed))
+
+    print(f"Running {args.clients} clients x {args.iterations} lifecycles")
+    with ctx.Pool(args.clients) as pool:
+        results = pool.map(run_client, [(db_url, w, args.iterations, args.warmup, args.seed)
+                                        for w in range(args.clients)])
+    wall = max(r[1] for r in results) - min(r[0] for r in results)
+    samples = [s for r in results for s in r[2]]
+    routes = summarize(samples, wall)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(routes, baseline, args.tolerance) if baseline else []
+
+    out = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": {"users": args.users, "mechanics": args.mechanics, "requests": args.requests,
+                     "notifications": args.notifications, "seed": args.seed},
+            "clients": args.clients,
+            "iterations": args.iterations,
+        },
+        "total": {"requests": len(samples), "errors": sum(1 for s in samples if not s[3]),
+                  "seconds": wall, "rps": len(samples) / wall},
+        "routes": routes,
+        "baseline": args.baseline,
+        "regressions": regressions,
+    }
+    with open(args.out, "w") as f:
+        json.dump(out, f, indent=2)
+
+    print_table(routes, baseline)
+    print(f"\n{out['total']['requests']} requests in {wall:.1f}s ({out['total']['rps']:.1f} req/s), "
+          f"{out['total']['errors']} errors; results written to {args.out}")
+    for r in regressions:
+        print(f"REGRESSION {r['route']}: {r['metric']} {r['baseline']:.1f} -> {r['current']:.1f}")
+    return 1 if regressions else 0
+
+def _seed_with_url(db_url, db_path, *counts):
+    os.environ["DATABASE_URL"] = db_url
+    seed(db_path, *counts)
+
+if __name__ == "__main__":
+    sys.exit(main())
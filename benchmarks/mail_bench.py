@@ -0,0 +1,71 @@
+"""Sends-per-second benchmark: fresh SMTP connection per OTP vs the pooled Mailer.
+
+Needs a local sink:  pip install aiosmtpd
+Run from the repo root:  python -m benchmarks.mail_bench [--messages 500]
+"""
+import argparse
+import smtplib
+import time
+from email.mime.text import MIMEText
+
+from aiosmtpd.controller import Controller
+
+from mailer import Mailer
+
+SENDER = "bench@roadguard.local"
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+def per_message_connection(host, port, n):
+    """The old synchronous OTP path: connect, send one message, quit."""
+    for i in range(n):
+        msg = MIMEText(f"Your OTP is: {i:06d}. Do not share it with anyone.")
+        msg['Subject'] = "Your OTP for RoadGuard Registration"
+        msg['From'] = SENDER
+        msg['To'] = f"user{i}@example.com"
+        server = smtplib.SMTP(host, port)
+        server.sendmail(SENDER, [msg['To']], msg.as_string())
+        server.quit()
+
+def pooled(host, port, n, workers):
+    mailer = Mailer(host, port, sender=SENDER, starttls=False, workers=workers, queue_size=n)
+    for i in range(n):
+        mailer.submit(f"user{i}@example.com", "Your OTP for RoadGuard Registration",
+                      f"Your OTP is: {i:06d}. Do not share it with anyone.")
+    mailer.join()
+    mailer.stop()
+
+def timed(label, fn, handler):
+    before = handler.received
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    delivered = handler.received - before
+    print(f"{label:<28} {delivered:>6} sent {elapsed:>8.2f}s {delivered / elapsed:>9.1f} msg/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    handler = CountingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        timed("connection per message", lambda: per_message_connection("127.0.0.1", args.port, args.messages), handler)
+        for workers in args.workers:
+            timed(f"pooled mailer, {workers} worker(s)",
+                  lambda: pooled("127.0.0.1", args.port, args.messages, workers), handler)
+    finally:
+        controller.stop()
+
+if __name__ == "__main__":
+    main()
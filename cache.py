@@ -0,0 +1,45 @@
+import threading
+import time
+
+class SimpleCache:
+    """Tiny thread-safe in-process cache with per-key expiry.
+
+    Each worker keeps its own copy, so entries also expire after `ttl`
+    seconds to pick up writes made by other workers.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+
+    def get_or_set(self, key, factory, ttl=None):
+        """Return the cached value, computing and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when no key is given."""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
@@ -0,0 +1,63 @@
+import os
+
+from sqlalchemy import event
+
+DEFAULT_DATABASE_URL = 'sqlite:///roadguard.db'
+
+# Applied to every new SQLite connection. WAL lets readers run alongside the
+# single writer, and busy_timeout makes writers queue instead of failing with
+# "database is locked" when several workers commit at once.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': int(os.environ.get('ROADGUARD_SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'synchronous': 'NORMAL',
+    'mmap_size': int(os.environ.get('ROADGUARD_SQLITE_MMAP_BYTES', 256 * 1024 * 1024)),
+}
+
+def normalize_url(url):
+    """Accept the postgres:// scheme some hosts still hand out."""
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def engine_options(url):
+    """create_engine() keyword arguments for a database URL.
+
+    SQLite keeps SQLAlchemy's defaults; server databases get a pool sized by
+    ROADGUARD_DB_POOL_* environment variables, and connections are checked
+    before use so a restarted server does not surface as a request error.
+    """
+    if url.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('ROADGUARD_DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('ROADGUARD_DB_POOL_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('ROADGUARD_DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('ROADGUARD_DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+def database_config(url=None, replica_url=None):
+    """Flask-SQLAlchemy settings for the primary database and optional read replica."""
+    url = normalize_url(url or os.environ.get('DATABASE_URL') or DEFAULT_DATABASE_URL)
+    replica_url = normalize_url(replica_url or os.environ.get('DATABASE_REPLICA_URL'))
+    config = {
+        'SQLALCHEMY_DATABASE_URI': url,
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options(url),
+        'SQLALCHEMY_BINDS': {},
+    }
+    if replica_url:
+        config['SQLALCHEMY_BINDS']['replica'] = dict(engine_options(replica_url), url=replica_url)
+    return config
+
+def apply_sqlite_pragmas(engine, pragmas=SQLITE_PRAGMAS):
+    """Run the PRAGMAs on every connection the engine opens (SQLite only)."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
@@ -0,0 +1,125 @@
+import numpy as np
+
+from geo import EARTH_RADIUS_KM
+
+# Upper bound on distance-matrix cells held in memory at once (~16 MB of float64)
+BLOCK_CELLS = 2_000_000
+# Largest request x slot matrix the optimal matcher will build
+OPTIMAL_MAX_CELLS = 25_000_000
+
+# ----------------- Distances -----------------
+def distance_matrix(req_lat, req_lng, mech_lat, mech_lng):
+    """Haversine distances in km, shape (len(requests), len(mechanics))."""
+    p1 = np.radians(np.asarray(req_lat, dtype=np.float64))[:, None]
+    l1 = np.radians(np.asarray(req_lng, dtype=np.float64))[:, None]
+    p2 = np.radians(np.asarray(mech_lat, dtype=np.float64))[None, :]
+    l2 = np.radians(np.asarray(mech_lng, dtype=np.float64))[None, :]
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin((l2 - l1) / 2) ** 2
+    np.clip(a, 0.0, 1.0, out=a)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def nearest_candidates(req_lat, req_lng, mech_lat, mech_lng, k):
+    """Indices and distances of the k closest mechanics per request, closest first.
+
+    The full matrix is built in row blocks so memory stays bounded for large fleets.
+    """
+    n_req, n_mech = len(req_lat), len(mech_lat)
+    k = min(k, n_mech)
+    idx = np.empty((n_req, k), dtype=np.int64)
+    dist = np.empty((n_req, k), dtype=np.float64)
+    rows = max(1, BLOCK_CELLS // max(1, n_mech))
+    for start in range(0, n_req, rows):
+        stop = min(start + rows, n_req)
+        d = distance_matrix(req_lat[start:stop], req_lng[start:stop], mech_lat, mech_lng)
+        if k < n_mech:
+            part = np.argpartition(d, k - 1, axis=1)[:, :k]
+        else:
+            part = np.broadcast_to(np.arange(n_mech), d.shape)
+        part_d = np.take_along_axis(d, part, axis=1)
+        order = np.argsort(part_d, axis=1)
+        idx[start:stop] = np.take_along_axis(part, order, axis=1)
+        dist[start:stop] = np.take_along_axis(part_d, order, axis=1)
+    return idx, dist
+
+# ----------------- Matchers -----------------
+def greedy_assign(req_lat, req_lng, mech_lat, mech_lng, capacity, max_km=None, candidates=8):
+    """Match requests to mechanics, shortest pairs first, respecting per-mechanic capacity.
+
+    Returns (mechanic index per request or -1, distance per request or nan).
+    """
+    req_lat, req_lng = np.asarray(req_lat, dtype=np.float64), np.asarray(req_lng, dtype=np.float64)
+    mech_lat, mech_lng = np.asarray(mech_lat, dtype=np.float64), np.asarray(mech_lng, dtype=np.float64)
+    capacity = np.array(capacity, dtype=np.int64)
+    n_req = len(req_lat)
+    result = np.full(n_req, -1, dtype=np.int64)
+    result_km = np.full(n_req, np.nan)
+    todo = np.arange(n_req)
+
+    while todo.size:
+        avail = np.flatnonzero(capacity > 0)
+        if not avail.size:
+            break
+        cand, cand_km = nearest_candidates(req_lat[todo], req_lng[todo], mech_lat[avail], mech_lng[avail], candidates)
+        if max_km is not None:
+            # Candidates only get further away as mechanics fill up, so these can never match.
+            keep = cand_km[:, 0] <= max_km
+            todo, cand, cand_km = todo[keep], cand[keep], cand_km[keep]
+        k = cand.shape[1]
+        progress = False
+        for flat in np.argsort(cand_km, axis=None, kind='stable'):
+            row, col = divmod(int(flat), k)
+            req = todo[row]
+            if result[req] >= 0:
+                continue
+            km = cand_km[row, col]
+            if max_km is not None and km > max_km:
+                break
+            mech = avail[cand[row, col]]
+            if capacity[mech] <= 0:
+                continue
+            capacity[mech] -= 1
+            result[req] = mech
+            result_km[req] = km
+            progress = True
+        if not progress:
+            break
+        todo = todo[result[todo] < 0]
+    return result, result_km
+
+def optimal_assign(req_lat, req_lng, mech_lat, mech_lng, capacity, max_km=None):
+    """Minimum total distance matching via scipy's Hungarian solver.
+
+    Each mechanic is expanded into one column per free slot, so this is only
+    practical for small problems; use greedy_assign for large fleets.
+    """
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        raise RuntimeError("optimal dispatch requires scipy (pip install scipy)")
+    capacity = np.asarray(capacity, dtype=np.int64)
+    slots = np.repeat(np.arange(len(capacity)), np.clip(capacity, 0, None))
+    n_req = len(req_lat)
+    result = np.full(n_req, -1, dtype=np.int64)
+    result_km = np.full(n_req, np.nan)
+    if not n_req or not slots.size:
+        return result, result_km
+    if n_req * slots.size > OPTIMAL_MAX_CELLS:
+        raise ValueError(f"problem too large for optimal dispatch ({n_req} x {slots.size}); use greedy")
+    d = distance_matrix(req_lat, req_lng, np.asarray(mech_lat)[slots], np.asarray(mech_lng)[slots])
+    cost = d if max_km is None else np.where(d <= max_km, d, 1e9)
+    rows, cols = linear_sum_assignment(cost)
+    ok = d[rows, cols] <= (np.inf if max_km is None else max_km)
+    result[rows[ok]] = slots[cols[ok]]
+    result_km[rows[ok]] = d[rows[ok], cols[ok]]
+    return result, result_km
+
+MATCHERS = {
+    'greedy': greedy_assign,
+    'optimal': optimal_assign,
+}
+
+def solve(req_lat, req_lng, mech_lat, mech_lng, capacity, method='greedy', max_km=None):
+    """Run the named matcher; see greedy_assign for the return value."""
+    if method not in MATCHERS:
+        raise ValueError(f"unknown dispatch method {method!r}")
+    return MATCHERS[method](req_lat, req_lng, mech_lat, mech_lng, capacity, max_km=max_km)
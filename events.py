@@ -0,0 +1,149 @@
+import json
+import queue
+import threading
+
+# Per-subscriber buffer; a slow client that falls this far behind gets a resync
+SUBSCRIBER_QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+
+LAGGED = object()
+
+# ----------------- Brokers -----------------
+class Broker:
+    """Pub/sub interface used by the SSE endpoint and the write paths."""
+
+    def publish(self, channel, event):
+        raise NotImplementedError
+
+    def subscribe(self, channels):
+        """Return a Subscription for the given channel names."""
+        raise NotImplementedError
+
+class Subscription:
+    def get(self, timeout):
+        """Next event dict, LAGGED if events were dropped, or None on timeout."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class _MemorySubscription(Subscription):
+    def __init__(self, broker, channels, maxsize):
+        self.broker = broker
+        self.channels = channels
+        self.queue = queue.Queue(maxsize)
+        self.lagged = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Never block the publisher on a slow reader; tell it to resync instead
+            self.lagged = True
+
+    def get(self, timeout):
+        if self.lagged:
+            self.lagged = False
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            return LAGGED
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+class MemoryBroker(Broker):
+    """In-process broker; only reaches subscribers in the same worker."""
+
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self._subs = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self._lock:
+            subs = list(self._subs.get(channel, ()))
+        for sub in subs:
+            sub.put(event)
+
+    def subscribe(self, channels):
+        sub = _MemorySubscription(self, list(channels), self.maxsize)
+        with self._lock:
+            for ch in sub.channels:
+                self._subs.setdefault(ch, set()).add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            for ch in sub.channels:
+                subs = self._subs.get(ch)
+                if subs:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subs[ch]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subs in self._subs.values() for s in subs})
+
+class _RedisSubscription(Subscription):
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout):
+        msg = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if not msg:
+            return None
+        return json.loads(msg['data'])
+
+    def close(self):
+        self.pubsub.close()
+
+class RedisBroker(Broker):
+    """Broker backed by any Redis-compatible server, for multi-worker deployments."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("redis broker requires the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel, event):
+        self.client.publish(channel, json.dumps(event))
+
+    def subscribe(self, channels):
+        pubsub = self.client.pubsub()
+        pubsub.subscribe(*channels)
+        return _RedisSubscription(pubsub)
+
+def create_broker(url=None):
+    """memory:// (default) or redis://host:port/db."""
+    if not url or url.startswith('memory://'):
+        return MemoryBroker()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBroker(url)
+    raise ValueError(f"unsupported broker url {url!r}")
+
+# ----------------- SSE -----------------
+def sse_format(event, name=None):
+    data = json.dumps(event)
+    return (f"event: {name}\n" if name else "") + f"data: {data}\n\n"
+
+def sse_stream(subscription, heartbeat=HEARTBEAT_SECONDS):
+    """Yield SSE frames from a subscription until the client disconnects."""
+    try:
+        yield "retry: 5000\n: connected\n\n"
+        while True:
+            event = subscription.get(timeout=heartbeat)
+            if event is None:
+                yield ": ping\n\n"
+            elif event is LAGGED:
+                yield sse_format({}, name='resync')
+            else:
+                yield sse_format(event)
+    finally:
+        subscription.close()
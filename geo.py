@@ -0,0 +1,244 @@
+import heapq
+import math
+import threading
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180.0
+
+# ----------------- Helpers -----------------
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in km."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+# ----------------- Geohash -----------------
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def geohash(lat, lng, precision=5):
+    """Standard base-32 geohash; precision 5 cells are roughly 5 x 5 km."""
+    lat_lo, lat_hi, lng_lo, lng_hi = -90.0, 90.0, -180.0, 180.0
+    out = []
+    bits = 0
+    ch = 0
+    even = True
+    while len(out) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                ch = ch << 1 | 1
+                lng_lo = mid
+            else:
+                ch <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = ch << 1 | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(GEOHASH_ALPHABET[ch])
+            bits = ch = 0
+    return ''.join(out)
+
+def geohash_bounds(cell):
+    """(south, west, north, east) of a geohash cell."""
+    lat_lo, lat_hi, lng_lo, lng_hi = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for c in cell:
+        ch = GEOHASH_ALPHABET.index(c)
+        for shift in range(4, -1, -1):
+            bit = ch >> shift & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                lng_lo, lng_hi = (mid, lng_hi) if bit else (lng_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return lat_lo, lng_lo, lat_hi, lng_hi
+
+def geohash_center(cell):
+    south, west, north, east = geohash_bounds(cell)
+    return (south + north) / 2, (west + east) / 2
+
+# ----------------- Spatial index -----------------
+def normalize_lng(lng):
+    """Longitude in [-180, 180)."""
+    return (lng + 180.0) % 360.0 - 180.0
+
+def box_min_km(lat, lng, south, west, north, east):
+    """Lower bound on the distance from a point to any point of a lat/lng box (no box crosses ±180)."""
+    if west <= lng <= east:
+        if lat < south:
+            return (south - lat) * KM_PER_DEG
+        if lat > north:
+            return (lat - north) * KM_PER_DEG
+        return 0.0
+    # Outside the box's longitudes the nearest point lies on one of its meridian
+    # edges. Along a meridian the distance is smallest at the edge's ends or at
+    # the foot of the perpendicular from the point; haversine handles the
+    # wrap across the antimeridian by itself.
+    p = math.radians(lat)
+    best = float('inf')
+    for edge in (west, east):
+        dl = math.radians(edge - lng)
+        foot = math.degrees(math.atan2(math.sin(p), math.cos(p) * math.cos(dl)))
+        for cand in (south, north, min(north, max(south, foot))):
+            best = min(best, haversine_km(lat, lng, cand, edge))
+    return best
+
+class _Node:
+    __slots__ = ('south', 'west', 'north', 'east', 'depth', 'children', 'ids', 'count')
+
+    def __init__(self, south, west, north, east, depth):
+        self.south, self.west, self.north, self.east = south, west, north, east
+        self.depth = depth
+        self.children = None  # four _Nodes once split
+        self.ids = set()      # mechanic ids, leaves only
+        self.count = 0        # mechanics in this subtree
+
+    def child_for(self, lat, lng):
+        i = (2 if lat >= (self.south + self.north) / 2 else 0) + (1 if lng >= (self.west + self.east) / 2 else 0)
+        return self.children[i]
+
+    def split(self, pos):
+        mid_lat = (self.south + self.north) / 2
+        mid_lng = (self.west + self.east) / 2
+        d = self.depth + 1
+        self.children = [
+            _Node(self.south, self.west, mid_lat, mid_lng, d), _Node(self.south, mid_lng, mid_lat, self.east, d),
+            _Node(mid_lat, self.west, self.north, mid_lng, d), _Node(mid_lat, mid_lng, self.north, self.east, d),
+        ]
+        for mech_id in self.ids:
+            child = self.child_for(*pos[mech_id])
+            child.ids.add(mech_id)
+            child.count += 1
+        self.ids = set()
+
+    def collect(self, out):
+        if self.children is None:
+            out.update(self.ids)
+        else:
+            for child in self.children:
+                child.collect(out)
+
+class MechanicIndex:
+    """In-process quadtree of mechanic positions.
+
+    A leaf splits into four once it holds more than leaf_size mechanics, so
+    dense metros get small cells and empty oceans stay one big cell whatever
+    the mix. nearest() is a best-first search ordered by the exact minimum
+    distance to each cell, which also sees across the antimeridian. Busy
+    mechanics stay in the tree but are skipped by nearest().
+    """
+
+    MAX_DEPTH = 24  # ~1 m cells; mechanics sharing a spot just share a leaf
+
+    def __init__(self, leaf_size=16):
+        self.leaf_size = leaf_size
+        self._root = _Node(-90.0, -180.0, 90.0, 180.0, 0)
+        self._pos = {}        # mechanic id -> (lat, normalized lng)
+        self._busy = set()
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._pos)
+
+    def update(self, mech_id, lat, lng):
+        """Insert or move a mechanic."""
+        if lat is None or lng is None:
+            self.remove(mech_id)
+            return
+        lat = min(90.0, max(-90.0, lat))
+        lng = normalize_lng(lng)
+        with self._lock:
+            if mech_id in self._pos:
+                self._remove(mech_id)
+            self._pos[mech_id] = (lat, lng)
+            node = self._root
+            while True:
+                node.count += 1
+                if node.children is None:
+                    break
+                node = node.child_for(lat, lng)
+            node.ids.add(mech_id)
+            if len(node.ids) > self.leaf_size and node.depth < self.MAX_DEPTH:
+                node.split(self._pos)
+
+    def remove(self, mech_id):
+        with self._lock:
+            if mech_id in self._pos:
+                self._remove(mech_id)
+            self._busy.discard(mech_id)
+
+    def _remove(self, mech_id):
+        lat, lng = self._pos.pop(mech_id)
+        node = self._root
+        while True:
+            node.count -= 1
+            if node.children is None:
+                node.ids.discard(mech_id)
+                return
+            if node.count <= self.leaf_size // 2:
+                # Few enough left below here to fold the subtree back into one leaf
+                ids = set()
+                node.collect(ids)
+                ids.discard(mech_id)
+                node.children = None
+                node.ids = ids
+                return
+            node = node.child_for(lat, lng)
+
+    def set_busy(self, mech_id, busy=True):
+        with self._lock:
+            if busy:
+                self._busy.add(mech_id)
+            else:
+                self._busy.discard(mech_id)
+
+    def is_busy(self, mech_id):
+        return mech_id in self._busy
+
+    def position(self, mech_id):
+        return self._pos.get(mech_id)
+
+    def nearest(self, lat, lng, k=5, include_busy=False):
+        """Return up to k (distance_km, mechanic_id) tuples, closest first."""
+        if k <= 0:
+            return []
+        lng = normalize_lng(lng)
+        out = []
+        with self._lock:
+            busy = () if include_busy else self._busy
+            pos = self._pos
+            # Cells keyed by their lower bound, mechanics by their distance: whatever
+            # pops first is closer than anything still queued.
+            heap = [(0.0, 0, self._root)]
+            tie = 1
+            while heap and len(out) < k:
+                dist, _, item = heapq.heappop(heap)
+                if not isinstance(item, _Node):
+                    out.append((dist, item))
+                    continue
+                if item.children is None:
+                    for mech_id in item.ids:
+                        if mech_id not in busy:
+                            mlat, mlng = pos[mech_id]
+                            heapq.heappush(heap, (haversine_km(lat, lng, mlat, mlng), tie, mech_id))
+                            tie += 1
+                else:
+                    for child in item.children:
+                        if child.count:
+                            bound = box_min_km(lat, lng, child.south, child.west, child.north, child.east)
+                            heapq.heappush(heap, (bound, tie, child))
+                            tie += 1
+        return out
@@ -0,0 +1,170 @@
+import logging
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from email.mime.text import MIMEText
+
+log = logging.getLogger(__name__)
+
+class MailQueueFull(Exception):
+    pass
+
+class Mailer:
+    """Background email sender.
+
+    Messages go into a bounded queue drained by a small pool of worker
+    threads. Each worker keeps its own SMTP connection open between
+    messages, reconnects when it drops, and retries failed sends with
+    exponential backoff. Delivery state is kept per message id.
+    """
+
+    def __init__(self, host, port, username=None, password=None, sender=None, starttls=True,
+                 workers=4, queue_size=1000, max_attempts=4, backoff=1.0, timeout=10,
+                 idle_check=30, status_limit=10000, smtp_factory=smtplib.SMTP):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self.starttls = starttls
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.status_limit = status_limit
+        self.smtp_factory = smtp_factory
+        self._queue = queue.Queue(queue_size)
+        self._status = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    # ----------------- Public API -----------------
+    def submit(self, to_email, subject, body):
+        """Queue a message and return its id; raises MailQueueFull when saturated."""
+        self.start()
+        message_id = uuid.uuid4().hex
+        self._set_status(message_id, status='queued', attempts=0, error=None)
+        try:
+            self._queue.put_nowait((message_id, to_email, subject, body))
+        except queue.Full:
+            self._set_status(message_id, status='failed', error='queue full')
+            raise MailQueueFull()
+        return message_id
+
+    def status(self, message_id):
+        with self._lock:
+            info = self._status.get(message_id)
+            return dict(info) if info else None
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def start(self):
+        """Start the workers, replacing any that have died since the last call."""
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                t = threading.Thread(target=self._worker, name=f"mailer-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def join(self):
+        """Block until every queued message has been handled."""
+        self._queue.join()
+
+    def stop(self, timeout=5):
+        """Let workers finish the queue, then close their connections."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put((None, None, None, None))
+        deadline = time.monotonic() + timeout
+        for t in threads:
+            t.join(max(0, deadline - time.monotonic()))
+
+    # ----------------- Internals -----------------
+    def _set_status(self, message_id, **fields):
+        with self._lock:
+            info = self._status.setdefault(message_id, {})
+            info.update(fields, updated_at=time.time())
+            self._status.move_to_end(message_id)
+            while len(self._status) > self.status_limit:
+                self._status.popitem(last=False)
+
+    def _connect(self):
+        conn = self.smtp_factory(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            conn.starttls()
+        if self.username and self.password:
+            conn.login(self.username, self.password)
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        if conn is None:
+            return
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def _worker(self):
+        conn = None
+        last_used = 0.0
+        while True:
+            message_id, to_email, subject, body = self._queue.get()
+            try:
+                if message_id is None:
+                    self._close(conn)
+                    return
+                # A connection idle this long may have been dropped by the server
+                if conn is not None and time.monotonic() - last_used > self.idle_check:
+                    try:
+                        conn.noop()
+                    except (smtplib.SMTPException, OSError):
+                        self._close(conn)
+                        conn = None
+                try:
+                    conn = self._deliver(conn, message_id, to_email, subject, body)
+                except Exception as e:
+                    # e.g. UnicodeEncodeError for an address smtplib cannot encode;
+                    # fail this message and drop the half-used connection, but keep the worker
+                    log.exception("sending %s to %s failed", message_id, to_email)
+                    self._set_status(message_id, status='failed', error=str(e))
+                    self._close(conn)
+                    conn = None
+                last_used = time.monotonic()
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, conn, message_id, to_email, subject, body):
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = to_email
+        for attempt in range(1, self.max_attempts + 1):
+            self._set_status(message_id, status='sending', attempts=attempt)
+            try:
+                if conn is None:
+                    conn = self._connect()
+                conn.sendmail(self.sender, [to_email], msg.as_string())
+                self._set_status(message_id, status='sent', error=None)
+                return conn
+            except smtplib.SMTPRecipientsRefused as e:
+                # Permanent for this address; the connection itself is fine
+                self._set_status(message_id, status='failed', error=str(e))
+                return conn
+            except (smtplib.SMTPException, OSError) as e:
+                log.warning("sending %s to %s failed (attempt %d): %s", message_id, to_email, attempt, e)
+                self._close(conn)
+                conn = None
+                if attempt == self.max_attempts:
+                    self._set_status(message_id, status='failed', error=str(e))
+                    return conn
+                self._set_status(message_id, status='retrying', error=str(e))
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+        return conn
@@ -0,0 +1,189 @@
+import bisect
+import logging
+import threading
+import time
+
+from flask import (Response, abort, before_render_template, current_app, g, has_request_context, request,
+                   template_rendered)
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# ----------------- Prometheus primitives -----------------
+class Histogram:
+    """Labelled histogram rendered in Prometheus text format."""
+
+    def __init__(self, name, help, buckets, labels=('route',)):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+            items = [(k, list(v)) for k, v in items]
+        for label_values, series in items:
+            base = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            sep = ',' if base else ''
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{base}}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{base}}} {series[-1]}')
+        return '\n'.join(lines)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            base = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{base}}} {value}')
+        return '\n'.join(lines)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# ----------------- Request instrumentation -----------------
+class Metrics:
+    """Per-route request latency, SQL query count/time and template render time.
+
+    Hooks SQLAlchemy cursor events and Flask request/template signals; the
+    per-request bookkeeping is a few perf_counter() calls stored on flask.g.
+    Streamed responses are observed when their body closes, so the queries a
+    stream_with_context() generator runs are counted too. Figures are per
+    process.
+    """
+
+    def __init__(self, app=None, db=None, query_budget=None):
+        self.query_budget = query_budget
+        self.request_seconds = Histogram('roadguard_request_duration_seconds', 'Request latency', LATENCY_BUCKETS)
+        self.sql_seconds = Histogram('roadguard_request_sql_seconds', 'Total SQL time per request', LATENCY_BUCKETS)
+        self.sql_queries = Histogram('roadguard_request_sql_queries', 'SQL statements per request', QUERY_BUCKETS)
+        self.template_seconds = Histogram('roadguard_request_template_seconds', 'Template render time per request', LATENCY_BUCKETS)
+        self.responses = Counter('roadguard_responses_total', 'Responses by route and status', ('route', 'status'))
+        self.over_budget = Counter('roadguard_query_budget_exceeded_total', 'Requests over the query budget', ('route',))
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        if self.query_budget is None:
+            self.query_budget = app.config.get('QUERY_BUDGET', 25)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        with app.app_context():
+            engines = list(db.engines.values())
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.extensions['roadguard_metrics'] = self
+
+    # SQL
+    @staticmethod
+    def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g._sql_start = time.perf_counter()
+
+    @staticmethod
+    def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and '_sql_start' in g:
+            g._sql_time = g.get('_sql_time', 0.0) + time.perf_counter() - g._sql_start
+            g._sql_count = g.get('_sql_count', 0) + 1
+
+    # Templates
+    @staticmethod
+    def _before_render(sender, template, context, **extra):
+        g._tpl_start = time.perf_counter()
+
+    @staticmethod
+    def _after_render(sender, template, context, **extra):
+        if '_tpl_start' in g:
+            g._tpl_time = g.get('_tpl_time', 0.0) + time.perf_counter() - g._tpl_start
+
+    # Requests
+    @staticmethod
+    def _before_request():
+        g._req_start = time.perf_counter()
+        g._sql_time = 0.0
+        g._sql_count = 0
+        g._tpl_time = 0.0
+
+    def _after_request(self, response):
+        if '_req_start' not in g:
+            return response
+        state = g._get_current_object()
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        method, path, status = request.method, request.path, response.status_code
+        # A streamed body runs its queries after the headers are sent, so
+        # Server-Timing can only cover the work so far; the histograms and the
+        # budget check wait until the server has drained and closed the body.
+        response.headers['Server-Timing'] = (
+            f'db;dur={state._sql_time * 1000:.1f};desc="{state._sql_count} queries", '
+            f'tpl;dur={state._tpl_time * 1000:.1f}, '
+            f'total;dur={(time.perf_counter() - state._req_start) * 1000:.1f}'
+        )
+        if response.is_streamed:
+            response.call_on_close(lambda: self._observe(state, route, method, path, status))
+        else:
+            self._observe(state, route, method, path, status)
+        return response
+
+    def _observe(self, state, route, method, path, status):
+        total = time.perf_counter() - state._req_start
+        sql_time, sql_count, tpl_time = state._sql_time, state._sql_count, state._tpl_time
+
+        self.request_seconds.observe(total, route)
+        self.sql_seconds.observe(sql_time, route)
+        self.sql_queries.observe(sql_count, route)
+        self.template_seconds.observe(tpl_time, route)
+        self.responses.inc(route, status)
+
+        if self.query_budget and sql_count > self.query_budget:
+            self.over_budget.inc(route)
+            log.warning("%s %s ran %d SQL queries (budget %d)", method, path, sql_count, self.query_budget)
+
+    def render(self):
+        parts = [self.request_seconds, self.sql_seconds, self.sql_queries, self.template_seconds,
+                 self.responses, self.over_budget]
+        return '\n'.join(p.render() for p in parts) + '\n'
+
+    def metrics_view(self):
+        token = current_app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
@@ -1,60 +1,122 @@
-from flask import Blueprint, request, session, jsonify
+from flask import Blueprint, current_app, request, jsonify
+import atexit
+import hmac
 import random
-import smtplib
-from email.mime.text import MIMEText
-from datetime import datetime, timedelta
+from mailer import Mailer, MailQueueFull
+from otp_store import Sweeper, create_limiter, create_store
 
 otp_bp = Blueprint('otp', __name__)
 
-# Config: change these to your email credentials
-SMTP_SERVER = 'smtp.gmail.com'
-SMTP_PORT = 587
-EMAIL_ADDRESS = 'rawatvaibhav27@gmail.com'
-EMAIL_PASSWORD = ''  # Use environment variables in production
+OTP_SUBJECT = "Your OTP for RoadGuard Registration"
+OTP_TTL_SECONDS = 5 * 60
+
+# Token buckets: burst capacity, then refill rate in tokens/second
+RATE_LIMITS = {
+    'send_email': (3, 1 / 60),
+    'send_ip': (10, 1 / 30),
+    'verify_email': (5, 1 / 60),
+    'verify_ip': (20, 1 / 10),
+}
+
+class OtpState:
+    """The mailer, OTP store and rate limiters behind the OTP routes.
+
+    Built by init_app() from app.config rather than at import, so nothing is
+    opened or started until an app exists. OTPs and rate-limit buckets live
+    server-side instead of in the session cookie; a sqlite:/// store is shared
+    by every worker process on the host, memory:// only by one.
+    """
+
+    def __init__(self, config):
+        self.mailer = Mailer(config['SMTP_SERVER'], config['SMTP_PORT'],
+                             username=config['EMAIL_ADDRESS'], password=config['EMAIL_PASSWORD'],
+                             sender=config['EMAIL_ADDRESS'], starttls=config['SMTP_STARTTLS'],
+                             workers=config['MAIL_WORKERS'], queue_size=config['MAIL_QUEUE_SIZE'])
+        url = config['OTP_STORE_URL']
+        self.store = create_store(url)
+        self.limiters = {name: create_limiter(url, name, capacity=capacity, rate=rate)
+                         for name, (capacity, rate) in RATE_LIMITS.items()}
+        self.sweeper = Sweeper(self.store, *self.limiters.values(), interval=60)
+
+def init_app(app):
+    state = OtpState(app.config)
+    atexit.register(state.mailer.stop)
+    app.extensions['roadguard_otp'] = state
+    return state
+
+def otp_state():
+    """The current app's OtpState, with its sweeper running in this process."""
+    state = current_app.extensions['roadguard_otp']
+    state.sweeper.start()
+    return state
 
 # ----------------- Helper -----------------
-def send_email(to_email, otp):
-    """Send OTP to email."""
-    subject = "Your OTP for RoadGuard Registration"
-    body = f"Your OTP is: {otp}. Do not share it with anyone."
-    
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = EMAIL_ADDRESS
-    msg['To'] = to_email
-    
+def otp_body(otp):
+    return f"Your OTP is: {otp}. Do not share it with anyone."
+
+def normalize_email(email):
+    """Lower-cased address with an IDNA-encoded domain, or None if SMTP cannot carry it.
+
+    smtplib only speaks ASCII envelopes, so a non-ASCII local part is rejected
+    here rather than failing later on the mail worker.
+    """
+    local, at, domain = email.strip().lower().rpartition('@')
+    if not at or not local or not domain or not local.isascii() or any(c.isspace() for c in local):
+        return None
     try:
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_ADDRESS, [to_email], msg.as_string())
-        server.quit()
-        return True
-    except Exception as e:
-        print("Error sending email:", e)
-        return False
+        domain = domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        return None
+    return f"{local}@{domain}"
+
+def queue_email(to_email, otp):
+    """Hand the OTP to the background mailer; returns its message id."""
+    return otp_state().mailer.submit(to_email, OTP_SUBJECT, otp_body(otp))
 
 # ----------------- Routes -----------------
+def rate_limited(retry_after):
+    resp = jsonify({"success": False, "message": "Too many attempts, try again later"})
+    resp.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return resp, 429
+
+def check_limits(*checks):
+    """Take a token from each (limiter, key) pair; return a 429 response if any is empty."""
+    for limiter, key in checks:
+        allowed, retry_after = limiter.allow(key)
+        if not allowed:
+            return rate_limited(retry_after)
+    return None
+
 @otp_bp.route('/send_otp', methods=['POST'])
 def send_otp():
     data = request.get_json(force=True)
     email = data.get('email')
     if not email:
         return jsonify({"success": False, "message": "Email is required"}), 400
+    email = normalize_email(email)
+    if not email:
+        return jsonify({"success": False, "message": "Enter a valid email address"}), 400
+
+    state = otp_state()
+    limited = check_limits((state.limiters['send_ip'], request.remote_addr), (state.limiters['send_email'], email))
+    if limited:
+        return limited
 
     otp = f"{random.randint(100000, 999999)}"  # 6-digit OTP
-    expires_at = datetime.utcnow() + timedelta(minutes=5)
+    state.store.put(email, otp, OTP_TTL_SECONDS)
 
-    # Store OTP in session
-    otps = session.get('otps', {})
-    otps[email] = {"otp": otp, "expires_at": expires_at.isoformat()}
-    session['otps'] = otps
-    session.modified = True  # Ensure session updates
+    try:
+        message_id = queue_email(email, otp)
+    except MailQueueFull:
+        return jsonify({"success": False, "message": "Mail service busy, try again shortly"}), 503
+    return jsonify({"success": True, "message": "OTP is on its way to your email", "message_id": message_id}), 202
 
-    if send_email(email, otp):
-        return jsonify({"success": True, "message": "OTP sent to your email"})
-    else:
-        return jsonify({"success": False, "message": "Failed to send OTP"})
+@otp_bp.route('/send_otp/status/<message_id>')
+def send_otp_status(message_id):
+    info = otp_state().mailer.status(message_id)
+    if not info:
+        return jsonify({"success": False, "message": "Unknown message"}), 404
+    return jsonify({"success": True, "status": info['status'], "attempts": info['attempts'], "error": info['error']})
 
 @otp_bp.route('/verify_otp', methods=['POST'])
 def verify_otp():
@@ -65,23 +127,20 @@ def verify_otp():
     if not email or not entered_otp:
         return jsonify({"success": False, "message": "Email and OTP required"}), 400
 
-    otps = session.get('otps', {})
-    otp_data = otps.get(email)
-
-    if not otp_data:
-        return jsonify({"success": False, "message": "No OTP found for this email"}), 400
+    email = normalize_email(email)
+    if not email:
+        return jsonify({"success": False, "message": "Enter a valid email address"}), 400
+    state = otp_state()
+    limited = check_limits((state.limiters['verify_ip'], request.remote_addr), (state.limiters['verify_email'], email))
+    if limited:
+        return limited
 
-    expires_at = datetime.fromisoformat(otp_data['expires_at'])
-    if datetime.utcnow() > expires_at:
-        otps.pop(email, None)
-        session['otps'] = otps
-        session.modified = True
-        return jsonify({"success": False, "message": "OTP has expired"}), 400
+    otp = state.store.get(email)
+    if not otp:
+        return jsonify({"success": False, "message": "No valid OTP for this email, it may have expired"}), 400
 
-    if otp_data['otp'] == str(entered_otp):
-        otps.pop(email, None)
-        session['otps'] = otps
-        session.modified = True
+    if hmac.compare_digest(otp, str(entered_otp)):
+        state.store.delete(email)
         return jsonify({"success": True, "message": "OTP verified"})
     else:
         return jsonify({"success": False, "message": "Incorrect OTP"}), 400
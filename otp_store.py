@@ -0,0 +1,249 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# ----------------- Stores -----------------
+class OtpStore:
+    """Keyed by email; one live OTP per address."""
+
+    def put(self, email, code, ttl):
+        raise NotImplementedError
+
+    def get(self, email):
+        """Return the code if present and unexpired, else None."""
+        raise NotImplementedError
+
+    def delete(self, email):
+        raise NotImplementedError
+
+    def sweep(self):
+        """Drop expired entries; returns how many were removed."""
+        raise NotImplementedError
+
+class MemoryOtpStore(OtpStore):
+    """Dict-backed store capped at max_entries (oldest entries are evicted first)."""
+
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # email -> (code, expires_at)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def put(self, email, code, ttl):
+        with self._lock:
+            self._data[email] = (code, time.time() + ttl)
+            self._data.move_to_end(email)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get(self, email):
+        with self._lock:
+            item = self._data.get(email)
+            if item is None:
+                return None
+            code, expires_at = item
+            if expires_at < time.time():
+                del self._data[email]
+                return None
+            return code
+
+    def delete(self, email):
+        with self._lock:
+            self._data.pop(email, None)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [email for email, (_, expires_at) in self._data.items() if expires_at < now]
+            for email in expired:
+                del self._data[email]
+        return len(expired)
+
+class SqliteConnections:
+    """One connection per thread to a SQLite file shared by every worker on the host.
+
+    Connections are tagged with the pid that opened them, so a worker forked
+    after the app was built (gunicorn --preload) opens its own instead of
+    sharing the parent's.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _setup(self, *statements):
+        """Run schema statements on a short-lived connection, leaving none open behind."""
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                for statement in statements:
+                    conn.execute(statement)
+        finally:
+            conn.close()
+
+class SqliteOtpStore(SqliteConnections, OtpStore):
+    """Shared by every worker on the host through one SQLite file."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._setup("CREATE TABLE IF NOT EXISTS otp (email TEXT PRIMARY KEY, code TEXT NOT NULL, expires_at REAL NOT NULL)",
+                    "CREATE INDEX IF NOT EXISTS ix_otp_expires ON otp (expires_at)")
+
+    def put(self, email, code, ttl):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO otp (email, code, expires_at) VALUES (?, ?, ?)",
+                         (email, code, time.time() + ttl))
+
+    def get(self, email):
+        row = self._conn().execute("SELECT code FROM otp WHERE email = ? AND expires_at >= ?",
+                                   (email, time.time())).fetchone()
+        return row[0] if row else None
+
+    def delete(self, email):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM otp WHERE email = ?", (email,))
+
+    def sweep(self):
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM otp WHERE expires_at < ?", (time.time(),)).rowcount
+
+def _sqlite_path(url):
+    path = url[len('sqlite:///'):]
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def create_store(url):
+    """memory:// (single process only) or sqlite:///path/to/otp.db."""
+    if url.startswith('memory://'):
+        return MemoryOtpStore()
+    if url.startswith('sqlite:///'):
+        return SqliteOtpStore(_sqlite_path(url))
+    raise ValueError(f"unsupported OTP store url {url!r}")
+
+class Sweeper:
+    """Runs sweep() on each store every `interval` seconds on a daemon thread.
+
+    start() is cheap to call on every request: it launches the thread once per
+    process, so a forked worker gets its own instead of a dead copy of the parent's.
+    """
+
+    def __init__(self, *stores, interval=60):
+        self.stores = stores
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._loop, name="otp-sweeper", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            for store in self.stores:
+                try:
+                    store.sweep()
+                except Exception:
+                    pass
+
+# ----------------- Rate limiting -----------------
+class RateLimiter:
+    """Token bucket per key: `capacity` burst, refilled at `rate` tokens/second.
+
+    Keys are kept in LRU order and capped at max_keys so a flood of distinct
+    emails or IPs cannot grow memory without bound.
+    """
+
+    def __init__(self, capacity, rate, max_keys=100_000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, last_refill)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Take one token; returns (allowed, seconds until the next token)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        retry_after = 0 if allowed else (1 - tokens) / self.rate
+        return allowed, retry_after
+
+    def sweep(self):
+        return 0
+
+class SqliteRateLimiter(SqliteConnections, RateLimiter):
+    """Token buckets in a SQLite file, so every worker on the host draws from the same bucket.
+
+    Several limiters can share one file; `name` keeps their keys apart.
+    """
+
+    def __init__(self, path, name, capacity, rate):
+        super().__init__(path)
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+        self._setup("CREATE TABLE IF NOT EXISTS rate_bucket (name TEXT NOT NULL, key TEXT NOT NULL, "
+                    "tokens REAL NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (name, key))")
+
+    def allow(self, key):
+        now = time.time()  # wall clock: monotonic time is not comparable across processes
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the write lock up front so two workers cannot both spend the last token
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_bucket WHERE name = ? AND key = ?",
+                               (self.name, key)).fetchone()
+            tokens, last = row if row else (self.capacity, now)
+            tokens = min(self.capacity, tokens + max(0.0, now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO rate_bucket (name, key, tokens, updated_at) VALUES (?, ?, ?, ?)",
+                         (self.name, key, tokens, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        retry_after = 0 if allowed else (1 - tokens) / self.rate
+        return allowed, retry_after
+
+    def sweep(self):
+        """Drop buckets that have refilled completely; they behave the same as a missing row."""
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM rate_bucket WHERE name = ? AND updated_at < ?",
+                                (self.name, time.time() - self.capacity / self.rate)).rowcount
+
+def create_limiter(url, name, capacity, rate):
+    """A RateLimiter kept alongside the OTP store: in memory for memory://, in the same file for sqlite:///."""
+    if url.startswith('memory://'):
+        return RateLimiter(capacity, rate)
+    if url.startswith('sqlite:///'):
+        return SqliteRateLimiter(_sqlite_path(url), name, capacity, rate)
+    raise ValueError(f"unsupported OTP store url {url!r}")
@@ -0,0 +1,49 @@
+import csv
+import json
+import zlib
+from io import StringIO
+
+REPORT_COLUMNS = ['ID', 'Title', 'Status', 'User', 'Mechanic', 'Created At']
+REPORT_FIELDS = ['id', 'title', 'status', 'user', 'mechanic', 'created_at']
+
+# ----------------- Encoders -----------------
+def _created(value, iso):
+    if value is None:
+        return ''
+    return value.isoformat() if iso else value.strftime('%d-%b-%Y %H:%M')
+
+def csv_chunks(partitions):
+    """Yield one CSV string per partition of rows, header first."""
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(REPORT_COLUMNS)
+    for rows in partitions:
+        for r in rows:
+            writer.writerow([r.id, r.title, r.status, r.user or '', r.mechanic or '', _created(r.created_at, False)])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def ndjson_chunks(partitions):
+    """Yield newline-delimited JSON, one object per row, one string per partition."""
+    for rows in partitions:
+        yield ''.join(
+            json.dumps(dict(zip(REPORT_FIELDS, (r.id, r.title, r.status, r.user, r.mechanic, _created(r.created_at, True)))))
+            + '\n'
+            for r in rows)
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of text chunks on the fly."""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = z.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield z.flush()
+
+FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'ndjson': (ndjson_chunks, 'application/x-ndjson'),
+}
@@ -0,0 +1,47 @@
+// Live request updates over Server-Sent Events.
+// Dashboards listen for `roadguard:request` and patch themselves in place.
+(function () {
+  const script = document.currentScript;
+  const url = script && script.dataset.eventsUrl;
+  if (!url || !window.EventSource) return;
+
+  function toast(message) {
+    if (!message) return;
+    let container = document.getElementById('toast-container');
+    if (!container) {
+      container = document.createElement('div');
+      container.id = 'toast-container';
+      document.body.appendChild(container);
+    }
+    const t = document.createElement('div');
+    t.className = 'toast info';
+    t.textContent = message;
+    container.appendChild(t);
+    setTimeout(() => {
+      t.classList.add('hide');
+      setTimeout(() => t.remove(), 500);
+    }, 4000);
+  }
+
+  function markUnread() {
+    const link = document.querySelector('.notification-link');
+    if (link && !link.querySelector('.red-dot')) {
+      const dot = document.createElement('span');
+      dot.className = 'red-dot';
+      link.appendChild(dot);
+    }
+  }
+
+  const source = new EventSource(url);
+  source.onmessage = function (e) {
+    const event = JSON.parse(e.data);
+    toast(event.message);
+    markUnread();
+    window.dispatchEvent(new CustomEvent('roadguard:request', { detail: event }));
+  };
+  // The server dropped events for this tab; fall back to a full reload.
+  source.addEventListener('resync', function () {
+    window.dispatchEvent(new CustomEvent('roadguard:resync'));
+  });
+  window.addEventListener('beforeunload', () => source.close());
+})();
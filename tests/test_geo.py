@@ -0,0 +1,69 @@
+import random
+
+from geo import MechanicIndex, haversine_km
+
+METROS = [(28.6, 77.2), (19.07, 72.88), (12.97, 77.59), (13.08, 80.27), (22.57, 88.36)]
+
+def brute_force(points, busy, lat, lng, k):
+    return sorted((haversine_km(lat, lng, *p), mech_id) for mech_id, p in points.items() if mech_id not in busy)[:k]
+
+def build(points, busy=()):
+    index = MechanicIndex()
+    for mech_id, (lat, lng) in points.items():
+        index.update(mech_id, lat, lng)
+    for mech_id in busy:
+        index.set_busy(mech_id)
+    return index
+
+def assert_matches_brute_force(points, busy, queries, k=10):
+    index = build(points, busy)
+    for lat, lng in queries:
+        got = index.nearest(lat, lng, k=k)
+        want = brute_force(points, busy, lat, lng, k)
+        assert [m for _, m in got] == [m for _, m in want], (lat, lng)
+
+def test_metros_with_rural_mechanics():
+    rnd = random.Random(1)
+    points = {}
+    for i in range(5000):
+        if i % 10 == 0:
+            points[i] = (rnd.uniform(8, 32), rnd.uniform(70, 88))
+        else:
+            lat, lng = METROS[i % len(METROS)]
+            points[i] = (rnd.gauss(lat, 0.15), rnd.gauss(lng, 0.15))
+    busy = set(range(0, 5000, 3))
+    queries = [points[rnd.randrange(5000)] for _ in range(30)] + [(rnd.uniform(8, 32), rnd.uniform(70, 88)) for _ in range(30)]
+    assert_matches_brute_force(points, busy, queries)
+
+def test_one_metro_with_mechanics_worldwide():
+    rnd = random.Random(2)
+    points = {i: (rnd.uniform(28.3, 28.9), rnd.uniform(76.9, 77.5)) if i % 7 else
+              (rnd.uniform(-60, 70), rnd.uniform(-180, 180)) for i in range(5000)}
+    busy = set(range(0, 5000, 3))
+    queries = [(rnd.uniform(28.3, 28.9), rnd.uniform(76.9, 77.5)) for _ in range(30)] + \
+              [(rnd.uniform(-80, 80), rnd.uniform(-180, 180)) for _ in range(30)] + [(89.5, 10.0), (-89.5, -100.0)]
+    assert_matches_brute_force(points, busy, queries)
+
+def test_nearest_across_the_antimeridian():
+    index = build({1: (0.0, 170.0), 2: (0.0, 179.0), 3: (0.0, -170.0)})
+    assert [m for _, m in index.nearest(0.0, -179.5, k=3)] == [2, 3, 1]
+    assert [m for _, m in index.nearest(0.0, 179.9, k=1)] == [2]
+
+def test_moves_and_removals_keep_results_exact():
+    rnd = random.Random(3)
+    points = {i: (rnd.gauss(28.6, 0.1), rnd.gauss(77.2, 0.1)) for i in range(2000)}
+    index = build(points)
+    for i in range(0, 2000, 2):
+        points[i] = (rnd.gauss(19.07, 0.1), rnd.gauss(72.88, 0.1))
+        index.update(i, *points[i])
+    for i in range(1, 2000, 4):
+        del points[i]
+        index.remove(i)
+    assert len(index) == len(points)
+    for lat, lng in [(28.6, 77.2), (19.07, 72.88), (23.0, 75.0)]:
+        assert [m for _, m in index.nearest(lat, lng, k=10)] == [m for _, m in brute_force(points, (), lat, lng, 10)]
+
+def test_busy_mechanics_are_skipped_unless_asked():
+    index = build({1: (28.6, 77.2), 2: (28.7, 77.2)}, busy={1})
+    assert [m for _, m in index.nearest(28.6, 77.2, k=2)] == [2]
+    assert [m for _, m in index.nearest(28.6, 77.2, k=2, include_busy=True)] == [1, 2]
@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the formats we accept -> stored extension
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+MIMETYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif', 'webp': 'image/webp'}
+
+# Resized copies: variant -> longest edge in pixels
+VARIANTS = {'thumb': 320, 'large': 1280}
+THUMB_QUALITY = 82
+
+NAME_RE = re.compile(r'^[0-9a-f]{64}\.(jpg|png|gif|webp)$')
+
+class UploadError(ValueError):
+    pass
+
+def sniff(head):
+    """Extension for an image header, or None if it is not a format we accept."""
+    for magic, ext in SIGNATURES:
+        if head.startswith(magic):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+# ----------------- Content-addressed storage -----------------
+class UploadStore:
+    """Files named by the SHA-256 of their bytes, so a re-uploaded photo is stored once.
+
+    Layout under root: originals in ab/<hash>.<ext>, resized copies in
+    <variant>/ab/<hash>.jpg. Names are immutable, which is what lets the
+    routes serve them with year-long cache headers.
+    """
+
+    def __init__(self, root, max_bytes=10 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def save(self, stream):
+        """Copy a file-like object to the store in chunks; returns the stored name."""
+        digest = hashlib.sha256()
+        size = 0
+        ext = None
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if ext is None:
+                        ext = sniff(chunk)
+                        if ext is None:
+                            raise UploadError("Only JPEG, PNG, GIF or WebP images can be uploaded")
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadError(f"Images must be under {self.max_bytes // (1024 * 1024)} MB")
+                    digest.update(chunk)
+                    out.write(chunk)
+            if ext is None:
+                raise UploadError("Uploaded file is empty")
+            name = f"{digest.hexdigest()}.{ext}"
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(tmp_path)  # duplicate of a photo we already have
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            return name
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def valid_name(name):
+        return bool(NAME_RE.match(name or ''))
+
+    def path(self, name):
+        return os.path.join(self.root, name[:2], name)
+
+    def variant_path(self, name, variant):
+        return os.path.join(self.root, variant, name[:2], name.rsplit('.', 1)[0] + '.jpg')
+
+# ----------------- Thumbnails -----------------
+class Thumbnailer:
+    """Builds the resized variants on a small thread pool, off the request thread.
+
+    Needs Pillow (in requirements.txt); if it is missing `available` is False
+    and submit() does nothing, so callers fall back to the original file.
+    """
+
+    def __init__(self, store, variants=VARIANTS, workers=2):
+        self.store = store
+        self.variants = variants
+        self.workers = workers
+        self._pool = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        try:
+            import PIL.Image  # noqa: F401
+            self.available = True
+        except ImportError:
+            self.available = False
+
+    def submit(self, name):
+        """Queue every missing variant of `name`; duplicate requests are ignored."""
+        if not self.available:
+            return
+        with self._lock:
+            if name in self._pending:
+                return
+            self._pending.add(name)
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='thumbnailer')
+        self._pool.submit(self._run, name)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+    def _run(self, name):
+        try:
+            self.build(name)
+        except Exception:
+            log.warning("thumbnailing %s failed", name, exc_info=True)
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+    def build(self, name):
+        from PIL import Image, ImageOps
+
+        todo = {v: px for v, px in self.variants.items()
+                if not os.path.exists(self.store.variant_path(name, v))}
+        if not todo:
+            return
+        with Image.open(self.store.path(name)) as img:
+            # JPEG can decode straight to a smaller scale, far cheaper than a full decode
+            img.draft('RGB', (max(todo.values()),) * 2)
+            img = ImageOps.exif_transpose(img)
+            if img.mode != 'RGB':
+                rgba = img.convert('RGBA')
+                img = Image.new('RGB', rgba.size, 'white')
+                img.paste(rgba, mask=rgba.getchannel('A'))
+            # Largest first so each smaller variant resizes an already reduced image
+            for variant, px in sorted(todo.items(), key=lambda kv: -kv[1]):
+                img.thumbnail((px, px), Image.LANCZOS)
+                self._write(img, self.store.variant_path(name, variant))
+
+    def _write(self, img, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.store.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                img.save(out, 'JPEG', quality=THUMB_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise